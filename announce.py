@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#!
+# announce.py
+# Requires: mpv, and espeak for the offline voice. $ apt install mpv espeak
+#
+# Speak a message with whichever text to speech engine is ready first.
+#
+# The google translate voice (gspeak) and a local espeak render are started
+# at the same time. The google voice is preferred, but only if its audio is
+# ready within the deadline. After the deadline the first to finish is
+# played, and if neither works the message is printed to the console.
+# A google fetch that loses the race still completes in the background and
+# is stored in the cache, ready for the next time.
+# A list of messages is one entry in the speech queue (speech_queue.py), so
+# nothing is spoken between them, and they are dropped together if late.
+#
+# Example of use:
+# announce("The time is exactly three o'clock in the afternoon.")
+# announce(["February the 14th of 2019 is Thursday and",
+#           "the time is just after ten past three in the afternoon."])
+#
+import sys
+import time
+import subprocess
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    from pylib.gspeak import fetch_mp3, play_mp3
+    from pylib.speech_queue import get_queue, NORMAL, DROPPED, INTERRUPTED
+    from pylib.audio_cache import get_cache
+    from pylib.check_internet import is_internet_cached
+    from pylib.voice_pack import lookup
+    from pylib.metrics import span, count, FALLBACKS
+except ImportError:
+    from gspeak import fetch_mp3, play_mp3
+    from speech_queue import get_queue, NORMAL, DROPPED, INTERRUPTED
+    from audio_cache import get_cache
+    from check_internet import is_internet_cached
+    from voice_pack import lookup
+    from metrics import span, count, FALLBACKS
+
+# Seconds from the start of the announcement the google voice may take.
+DEADLINE = 0.8
+# espeak voice and options, e.g. ("-s", "175") for the speaking rate.
+ESPEAK_VOICE = "en-us"
+ESPEAK_ARGS = ()
+
+_executor = ThreadPoolExecutor(max_workers=8)
+
+def fetch_online(message, language="en"):
+    # mp3 data for message from the voice pack, the cache, or google.
+    mp3_data = lookup(message, language)
+    if mp3_data is not None:
+        return mp3_data
+    mp3_data = get_cache().get(message, language)
+    if mp3_data is None:
+        mp3_data = fetch_mp3(message, language)
+        get_cache().put(message, language, mp3_data)
+    return mp3_data
+
+def render_espeak(message, voice=ESPEAK_VOICE, args=ESPEAK_ARGS):
+    # Render message with espeak and return the wav data. A render in the
+    # voice pack is used if there is one.
+    wav_data = lookup(message, voice, "wav")
+    if wav_data is not None:
+        return wav_data
+    with span("espeak"):
+        return subprocess.run(("espeak", "--stdout", "-v", voice) +
+                tuple(args) + (message,), stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, check=True).stdout
+
+def pick(online, offline, deadline):
+    """
+    Wait for the online future until the deadline (time.monotonic()), then
+    for whichever finishes first without an error.
+    Returns (audio data, file suffix), or (None, None) if both failed.
+    """
+    if online is not None:
+        try:
+            return online.result(max(0, deadline - time.monotonic())), ".mp3"
+        except Exception as e:
+            # TimeoutError if the google voice was not ready in time.
+            count(FALLBACKS, stage="announce", cause=type(e).__name__)
+    else:
+        count(FALLBACKS, stage="announce", cause="no_internet")
+    futures = {future: suffix for future, suffix in
+            ((online, ".mp3"), (offline, ".wav")) if future is not None}
+    for future in as_completed(futures):
+        if future.exception() is None:
+            return future.result(), futures[future]
+    return None, None
+
+def announce(clips, language="en", deadline=DEADLINE, voice=ESPEAK_VOICE,
+        priority=NORMAL, max_delay=None):
+    """
+    Speak one message, or a list of messages one after the other.
+    language = google translate language code.
+    deadline = seconds the google voice may take before the first ready
+               voice is used. Each clip in the list has the same deadline,
+               counted from the start of the announcement.
+    voice = espeak voice for the offline render.
+    priority = speech_queue priority.
+    max_delay = seconds from now after which the clips are out of date and
+                are dropped instead of spoken. None to always speak them.
+    Returns a list with "online", "offline", "console", "dropped" or
+    "interrupted" for each clip.
+    """
+    if isinstance(clips, str):
+        clips = [clips]
+    end = time.monotonic() + deadline
+
+    # Start every fetch and render up front, so later clips are ready by
+    # the time earlier clips have been played.
+    # With no network, only clips in the voice pack can be spoken online.
+    internet = is_internet_cached()
+    online = [_executor.submit(fetch_online, clip, language)
+            if internet or lookup(clip, language) is not None else None
+            for clip in clips]
+    offline = [_executor.submit(render_espeak, clip, voice) for clip in clips]
+
+    return speak_clips(clips, [partial(pick, online_future, offline_future,
+            end) for online_future, offline_future in zip(online, offline)],
+            priority, max_delay)
+
+def speak_clips(clips, audio, priority=NORMAL, max_delay=None):
+    """
+    Speak clips as one entry in the speech queue, so nothing else is spoken
+    between them and they are dropped, or spoken, together.
+    audio = for each clip, (data, suffix) or a function returning it, called
+            when the clip's turn comes. (None, None) prints the clip.
+    priority, max_delay = as for announce().
+    Returns a list as announce() does.
+    """
+    used = []
+    stopped = []
+
+    def play():
+        for clip, item in zip(clips, audio):
+            if stopped:
+                break
+            data, suffix = item() if callable(item) else item
+            if data is None:
+                print(clip)
+                used.append("console")
+            elif play_mp3(data, suffix=suffix,
+                    priority=priority) == INTERRUPTED:
+                # A more urgent utterance stopped this clip.
+                break
+            else:
+                used.append("online" if suffix == ".mp3" else "offline")
+            count("saytime_clips_total", source=used[-1])
+
+    # The stop for between clips. While a clip plays the speech queue stops
+    # that clip, and play() ends after it.
+    status = get_queue().say(play, lambda: stopped.append(True), priority,
+            max_delay, "announce")
+    rest = DROPPED if status == DROPPED else INTERRUPTED
+    for clip in clips[len(used):]:
+        count("saytime_clips_total", source=rest)
+        used.append(rest)
+    return used
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        announce(" ".join(sys.argv[1:]))
+    else:
+        announce("announce is a python3 program that races two voices.")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#!
+# audio_cache.py
+#
+# Persistent on-disk cache of text-to-speech audio for gspeak.
+#
+# Entries are keyed by the sha256 of (language, message) and stored as
+# <cache dir>/<first 2 hex chars>/<hex>.mp3
+# Writes go to a temporary file in the same directory and are renamed into
+# place, so a reader in another process sees either the whole file or none.
+# Each hit touches the file's mtime, and eviction removes the least
+# recently used files once the cache is over its size cap. Eviction holds an
+# flock() on a lock file so only one process prunes at a time.
+#
+# Example of use:
+# cache = get_cache()
+# mp3_data = cache.get("bonjour", "fr")
+# if mp3_data is None:
+#     mp3_data = fetch_mp3("bonjour", "fr")
+#     cache.put("bonjour", "fr", mp3_data)
+#
+import os
+import fcntl
+import hashlib
+import tempfile
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME",
+        os.path.expanduser("~/.cache")), "saytime")
+MAX_BYTES = 64 * 1024 * 1024
+# After eviction the cache is trimmed to this fraction of the size cap.
+LOW_WATER = 0.9
+
+def cache_key(message, language):
+    # Content address for a (message, language) pair.
+    return hashlib.sha256((language + "\0" + message).encode("utf-8")
+            ).hexdigest()
+
+class AudioCache:
+    """
+    On-disk LRU cache of audio bytes keyed by (message, language).
+    directory = where the files are kept
+    max_bytes = size cap for all the cached files together
+    suffix = file extension of the entries
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES,
+            suffix=".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock_path = os.path.join(directory, ".lock")
+        # Estimate of the cache size, measured on the first put().
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, message, language):
+        # File name for an entry, whether or not it exists.
+        key = cache_key(message, language)
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def __contains__(self, item):
+        message, language = item
+        return os.path.exists(self.path(message, language))
+
+    def get(self, message, language):
+        # Return the cached bytes, or None on a miss.
+        path = self.path(message, language)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # Mark as recently used.
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, message, language, data):
+        # Atomically store data and evict old entries if over the size cap.
+        path = self.path(message, language)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+        return path
+
+    def entries(self):
+        # List of (mtime, size, path) for every entry in the cache.
+        entries = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def size(self):
+        # Total bytes held in the cache.
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is below the low
+        water mark. Only one process evicts at a time.
+        """
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = self.entries()
+                total = sum(size for mtime, size, path in entries)
+                target = self.max_bytes * LOW_WATER
+                entries.sort()
+                for mtime, size, path in entries:
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    total -= size
+                self._size = total
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+_default_cache = None
+
+def get_cache():
+    # Shared cache in the default location, created on first use.
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AudioCache()
+    return _default_cache
+
+if __name__ == "__main__":
+
+    cache = get_cache()
+    print("Cache directory: {}".format(cache.directory))
+    print("Entries: {}  Size: {} bytes  Cap: {} bytes".format(
+            len(cache.entries()), cache.size(), cache.max_bytes))
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+#!
+# benchmark.py
+#
+# Repeatable benchmarks that need no network, sound card or mpv.
+#
+# phrase    get_time_phrase() for every minute of the day, terse and verbose
+# batch     saytime_batch.phrases() for 100000 timestamps (needs numpy)
+# internet  is_internet() and ConnectivityMonitor against listeners on
+#           127.0.0.1
+# gspeak    gspeak() end to end, from a local stand-in for translate_tts
+#           that serves canned mp3 data after a delay with jitter. A fake
+#           player takes the place of mpv.
+# prewarm   prewarm_cache.prewarm() of 100 clips from the stand-in, which
+#           answers 429 Too Many Requests for its first second. Fails
+#           unless every clip is fetched once the burst is over.
+#
+# Each benchmark reports p50, p95 and p99 per call. Results can be saved as
+# a baseline, and a later run compared with it: a percentile more than
+# --tolerance and at least 1 us slower than the baseline is reported and the
+# exit status is 1.
+#
+# $ benchmark.py --save baseline.json
+# $ benchmark.py --baseline baseline.json
+# $ benchmark.py --only gspeak --delay 0.05 --jitter 0.02
+#
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    from pylib.saytime_phrase import get_time_phrase, MINUTES_PER_DAY
+    from pylib.saytime_loadgen import percentile
+    from pylib.check_internet import is_internet, ConnectivityMonitor
+    from pylib.audio_cache import AudioCache
+    import pylib.audio_cache as audio_cache
+    import pylib.mpv_player as mpv_player
+    import pylib.saytime_batch as saytime_batch
+    import pylib.gspeak as gspeak
+    import pylib.prewarm_cache as prewarm_cache
+except ImportError:
+    from saytime_phrase import get_time_phrase, MINUTES_PER_DAY
+    from saytime_loadgen import percentile
+    from check_internet import is_internet, ConnectivityMonitor
+    from audio_cache import AudioCache
+    import audio_cache
+    import mpv_player
+    import saytime_batch
+    import gspeak
+    import prewarm_cache
+
+BENCHMARKS = ("phrase", "batch", "internet", "gspeak", "prewarm")
+REPEAT = 200
+# Stand-in server response time, seconds.
+DELAY = 0.02
+JITTER = 0.01
+# Fraction a percentile may be slower than the baseline.
+TOLERANCE = 0.2
+# Slowdowns of less than this many seconds are timer and scheduler noise.
+MIN_CHANGE = 1e-6
+PERCENTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+class BenchmarkError(Exception):
+    # A benchmark whose results are wrong, not just slow.
+    pass
+
+def summarize(samples):
+    # Percentiles of samples, in seconds.
+    samples = sorted(samples)
+    result = {name: percentile(samples, fraction)
+            for name, fraction in PERCENTILES}
+    result["count"] = len(samples)
+    return result
+
+def time_calls(function, repeat, per_sample=1):
+    # Seconds per call of function(), which makes per_sample calls.
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) / per_sample)
+    return samples
+
+class FakePlayer:
+    """
+    Stands in for mpv_player.MpvPlayer. Keeps what it was given and takes
+    play_time seconds to "play" it.
+    """
+    def __init__(self, play_time=0.0):
+        self.play_time = play_time
+        self.played = []
+
+    def ensure_running(self):
+        pass
+
+    def play_bytes(self, data, wait=True, suffix=".mp3"):
+        self.played.append(len(data))
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        time.sleep(self.play_time)
+        return True
+
+    def stop(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for translate_tts. Every GET is answered with mp3_data
+    after delay seconds, give or take up to jitter.
+    """
+    daemon_threads = True
+
+    def __init__(self, mp3_data, delay=DELAY, jitter=JITTER, seed=1,
+            throttle=0.0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.mp3_data = mp3_data
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.requests = 0
+        # Answer 429 until this time.monotonic(), set by start().
+        self.throttle = throttle
+        self.throttled_until = 0.0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/translate_tts".format(self.server_port)
+
+    def response_delay(self):
+        self.requests += 1
+        return max(0.0, self.delay +
+                self.random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        self.throttled_until = time.monotonic() + self.throttle
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as translate.google.com does. Without TCP_NODELAY the
+    # body waits for the client to ack the headers, adding 40 ms.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.response_delay())
+        if time.monotonic() < self.server.throttled_until:
+            self.send_response(429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(self.server.mp3_data)))
+        self.end_headers()
+        self.wfile.write(self.server.mp3_data)
+
+    def log_message(self, format, *args):
+        pass
+
+def bench_phrase(repeat):
+    results = {}
+    for name, verbose in (("phrase_terse", False), ("phrase_verbose", True)):
+        def every_minute():
+            for hour in range(24):
+                for minute in range(60):
+                    get_time_phrase(hour, minute, verbose)
+        results[name] = summarize(time_calls(every_minute, repeat,
+                MINUTES_PER_DAY))
+    return results
+
+def bench_batch(repeat, size=100000):
+    if not saytime_batch.numpy_available:
+        print("batch: skipped, numpy is not installed")
+        return {}
+    import numpy as np
+    times = np.random.default_rng(1).integers(1700000000, 1800000000, size)
+    results = {}
+    for name, verbose in (("batch_terse", False), ("batch_verbose", True)):
+        results[name] = summarize(time_calls(
+                lambda: saytime_batch.phrases(times, verbose),
+                max(1, repeat // 20), size))
+    return results
+
+def bench_internet(repeat):
+    # Listeners on 127.0.0.1 stand in for the public DNS servers.
+    listeners = []
+    for i in range(3):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1024)
+        listeners.append(listener)
+    targets = [listener.getsockname() for listener in listeners]
+    try:
+        host, port = targets[0]
+        probing = ConnectivityMonitor(targets, ttl=0)
+        cached = ConnectivityMonitor(targets)
+        cached.check()
+        return {
+            "is_internet": summarize(time_calls(
+                    lambda: is_internet(host, port, 1), repeat)),
+            "internet_probe": summarize(time_calls(probing.check, repeat)),
+            "internet_cached": summarize(time_calls(cached.is_internet,
+                    repeat)),
+        }
+    finally:
+        for listener in listeners:
+            listener.close()
+
+def bench_gspeak(repeat, delay=DELAY, jitter=JITTER, mp3_data=None):
+    if mp3_data is None:
+        mp3_data = b"ID3" + random.Random(1).randbytes(16 * 1024)
+    server = StandInServer(mp3_data, delay, jitter).start()
+    player = FakePlayer()
+    saved = gspeak.URL, mpv_player._player, audio_cache._default_cache
+    gspeak.URL = server.url
+    mpv_player._player = player
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            audio_cache._default_cache = AudioCache(directory)
+            count = iter(range(repeat))
+            results = {
+                # A different message each time, so each is fetched.
+                "gspeak_fetch": summarize(time_calls(lambda: gspeak.gspeak(
+                        "Benchmark message {}".format(next(count)),
+                        cache=False), repeat)),
+            }
+            gspeak.gspeak("Benchmark cached message")
+            results["gspeak_cached"] = summarize(time_calls(
+                    lambda: gspeak.gspeak("Benchmark cached message"),
+                    repeat))
+    finally:
+        gspeak.URL, mpv_player._player, audio_cache._default_cache = saved
+        server.stop()
+    if len(player.played) != 2 * repeat + 1:
+        print("gspeak: {} of {} messages played".format(len(player.played),
+                2 * repeat + 1))
+    return results
+
+def bench_prewarm(clips=100, throttle=1.0, cool_down=1.0):
+    # prewarm() through a burst of 429s, with a shorter cool down than the
+    # real one so it runs quickly.
+    try:
+        from pylib.resilient_fetch import Fetcher, CircuitBreaker
+    except ImportError:
+        from resilient_fetch import Fetcher, CircuitBreaker
+    mp3_data = b"ID3" + random.Random(1).randbytes(1024)
+    server = StandInServer(mp3_data, 0.0, 0.0, throttle=throttle).start()
+    saved = gspeak.URL, audio_cache._default_cache
+    gspeak.URL = server.url
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            audio_cache._default_cache = AudioCache(directory)
+            fetcher = Fetcher(breaker=CircuitBreaker(cool_down=cool_down))
+            start = time.perf_counter()
+            fetched, skipped, failed = prewarm_cache.prewarm(
+                    ["Prewarm clip {}".format(n) for n in range(clips)],
+                    rate=1000.0, fetcher=fetcher)
+            seconds = time.perf_counter() - start
+    finally:
+        gspeak.URL, audio_cache._default_cache = saved
+        server.stop()
+    if fetched != clips:
+        raise BenchmarkError("prewarm fetched {} of {} clips through a 429 "
+                "burst, {} failed".format(fetched, clips, failed))
+    return {"prewarm_429_burst": summarize([seconds])}
+
+def compare(results, baseline, tolerance=TOLERANCE, min_change=MIN_CHANGE):
+    # Lines describing each percentile slower than the baseline allows.
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for key, fraction in PERCENTILES:
+            before = baseline[name][key]
+            after = result[key]
+            if (after > before * (1 + tolerance) and
+                    after - before > min_change):
+                regressions.append("{} {} {:.1f} us, baseline {:.1f} us "
+                        "(+{:.0%})".format(name, key, after * 1e6,
+                        before * 1e6, after / before - 1))
+    return regressions
+
+def report(results):
+    for name, result in sorted(results.items()):
+        print("{:16} p50 {:10.1f} us  p95 {:10.1f} us  p99 {:10.1f} us  "
+                "({} samples)".format(name, result["p50"] * 1e6,
+                result["p95"] * 1e6, result["p99"] * 1e6, result["count"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks.")
+    parser.add_argument("--only", action="append", choices=BENCHMARKS,
+            help="run only this benchmark, may be given more than once")
+    parser.add_argument("--repeat", type=int, default=REPEAT,
+            help="samples per benchmark ({})".format(REPEAT))
+    parser.add_argument("--delay", type=float, default=DELAY,
+            help="stand-in server delay, seconds ({})".format(DELAY))
+    parser.add_argument("--jitter", type=float, default=JITTER,
+            help="stand-in server jitter, seconds ({})".format(JITTER))
+    parser.add_argument("--mp3", help="file served by the stand-in server")
+    parser.add_argument("--save", metavar="FILE",
+            help="save the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+            help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+            help="allowed slowdown against the baseline ({})".format(
+            TOLERANCE))
+    args = parser.parse_args(argv)
+
+    mp3_data = None
+    if args.mp3:
+        with open(args.mp3, "rb") as f:
+            mp3_data = f.read()
+    results = {}
+    failures = []
+    for name in args.only or BENCHMARKS:
+        if name == "phrase":
+            results.update(bench_phrase(args.repeat))
+        elif name == "batch":
+            results.update(bench_batch(args.repeat))
+        elif name == "internet":
+            results.update(bench_internet(args.repeat))
+        elif name == "gspeak":
+            results.update(bench_gspeak(args.repeat, args.delay, args.jitter,
+                    mp3_data))
+        elif name == "prewarm":
+            try:
+                results.update(bench_prewarm())
+            except BenchmarkError as e:
+                failures.append(str(e))
+    report(results)
+    for failure in failures:
+        print("FAIL:", failure)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("slower:", line)
+        if regressions:
+            return 1
+        print("No regressions against {}".format(args.baseline))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
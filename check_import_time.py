@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#!
+# check_import_time.py
+#
+# Cold start check for CI, or before a release. Each entry point is imported
+# in a new interpreter with python -X importtime and its import time is
+# compared with a budget. The fastest of --repeat runs is used, as the
+# others are slowed by whatever else the machine is doing.
+#
+# It also checks that importing them loads none of the backends that are
+# meant to be loaded on first use: GStreamer (gi), espeak, http.client/ssl
+# and numpy. Then the hot-key command, saytime.py --print, is run and its
+# wall time compared with a budget.
+#
+# Exit status 1 if anything is over budget or a backend was loaded.
+#
+# $ check_import_time.py
+# $ check_import_time.py --top 10              # slowest imports of each
+# $ check_import_time.py --scale 2             # on a slow CI machine
+#
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Entry point : import time budget in milliseconds.
+BUDGETS = {
+    "saytime_phrase": 15,
+    "saytime": 20,
+    "saytime_espeak": 25,
+    "google_tts_gstereamer": 60,
+    "announce": 90,
+}
+# Wall time budget for saytime.py --print, interpreter start up included.
+CLI_BUDGET = 60
+CLI = ("saytime.py", "--print")
+# Modules that no entry point may import.
+LAZY = ("gi", "espeak", "http.client", "ssl", "urllib.request", "numpy")
+REPEAT = 5
+
+def run_importtime(module):
+    """
+    Import module in a new interpreter.
+    Returns ({name: (self us, cumulative us)}, [module names loaded]).
+    """
+    code = "import sys, {}; print(' '.join(sys.modules))".format(module)
+    env = dict(os.environ, PYTHONPATH=DIRECTORY)
+    result = subprocess.run((sys.executable, "-X", "importtime", "-c", code),
+            capture_output=True, text=True, env=env, cwd=DIRECTORY,
+            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, result.stdout.split()
+
+def measure(module, repeat=REPEAT):
+    # Fastest of repeat imports: (ms, times of that run, modules loaded)
+    best = None
+    for i in range(repeat):
+        times, modules = run_importtime(module)
+        ms = times[module][1] / 1000
+        if best is None or ms < best[0]:
+            best = ms, times, modules
+    return best
+
+def measure_cli(repeat=REPEAT):
+    # Fastest wall time of the hot-key command, in milliseconds.
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run((sys.executable,) + CLI, cwd=DIRECTORY, check=True,
+                stdout=subprocess.DEVNULL)
+        ms = (time.perf_counter() - start) * 1000
+        best = ms if best is None else min(best, ms)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import times.")
+    parser.add_argument("--repeat", type=int, default=REPEAT,
+            help="runs of each, the fastest is used ({})".format(REPEAT))
+    parser.add_argument("--scale", type=float, default=1.0,
+            help="multiply every budget, e.g. for a slow machine")
+    parser.add_argument("--top", type=int, default=0,
+            help="show the slowest imports of each entry point")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module, budget in BUDGETS.items():
+        budget *= args.scale
+        ms, times, modules = measure(module, args.repeat)
+        loaded = [name for name in LAZY if name in modules]
+        print("{:24} {:7.1f} ms  budget {:5.0f} ms  {}".format(module, ms,
+                budget, "ok" if ms <= budget and not loaded else "FAIL"))
+        if ms > budget:
+            failures.append("{} takes {:.1f} ms to import".format(module, ms))
+        if loaded:
+            failures.append("{} imports {}".format(module, ", ".join(loaded)))
+        for name, (self_us, cumulative_us) in sorted(times.items(),
+                key=lambda item: -item[1][0])[:args.top]:
+            print("    {:36} self {:6.1f} ms  cumulative {:6.1f} ms".format(
+                    name, self_us / 1000, cumulative_us / 1000))
+
+    budget = CLI_BUDGET * args.scale
+    ms = measure_cli(args.repeat)
+    print("{:24} {:7.1f} ms  budget {:5.0f} ms  {}".format(" ".join(CLI), ms,
+            budget, "ok" if ms <= budget else "FAIL"))
+    if ms > budget:
+        failures.append("{} takes {:.1f} ms".format(" ".join(CLI), ms))
+
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -7,13 +7,90 @@
 #
 # Check if the internet is available by connecting to Google DNS at 8.8.8.8
 #
+# For repeated checks use is_internet_cached(). It probes several DNS
+# servers at once, keeps the result for TTL seconds and refreshes it in the
+# background, so most calls return at once. The result is shared with other
+# processes through STATE_FILE, so saytime started from cron or a hotkey
+# usually does not probe at all.
+#
 # Example of use:
 # Could be used before using google translate web-site and fall back to 
 # espeak if no network avaialble.
 #
 # Ian Stewart - Mar 2019
 #
+import os
+import json
+import time
+import errno
+import fcntl
 import socket
+import tempfile
+import selectors
+import threading
+from collections import deque
+try:
+    from pylib.metrics import span, count
+except ImportError:
+    from metrics import span, count
+
+# Targets probed together by the ConnectivityMonitor. First to answer wins.
+TARGETS = (("8.8.8.8", 53), ("1.1.1.1", 53), ("8.8.4.4", 53))
+# Seconds a probe result is used before it is refreshed.
+TTL = 30.0
+# Bounds for the monitor's probe timeout, adapted from measured RTTs.
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 1.5
+# Last probe result shared between processes, e.g. saytime run from cron.
+STATE_FILE = os.path.join(os.environ.get("XDG_RUNTIME_DIR",
+        tempfile.gettempdir()), "saytime-internet-{}.json".format(os.getuid()))
+
+def probe(targets, timeout):
+    """
+    Start a TCP connect to every (host, port) in targets at once and wait
+    for the first to succeed. Nothing is sent; sockets are always closed.
+    Returns (True, seconds taken) or (False, None) if none connect in time.
+    A target that cannot be resolved or connected to counts as unreachable.
+    """
+    with span("internet_probe"):
+        return _probe_targets(targets, timeout)
+
+def _probe_targets(targets, timeout):
+    start = time.monotonic()
+    selector = selectors.DefaultSelector()
+    sockets = []
+    try:
+        for host, port in targets:
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sockets.append(sock)
+                sock.setblocking(False)
+                error = sock.connect_ex((host, port))
+            except OSError:
+                # E.g. a host name that does not resolve, or no IPv6.
+                # This target is unreachable, try the others.
+                continue
+            if error == 0:
+                return True, time.monotonic() - start
+            if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE)
+
+        deadline = start + timeout
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, events in selector.select(remaining):
+                sock = key.fileobj
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    return True, time.monotonic() - start
+                selector.unregister(sock)
+        return False, None
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
 
 def is_internet(host="8.8.8.8", port=53, timeout=3):
     """
@@ -21,13 +98,172 @@ def is_internet(host="8.8.8.8", port=53, timeout=3):
     OpenPort: 53/tcp
     Service: domain (DNS/TCP)
     """
-    try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+    return probe([(host, port)], timeout)[0]
+
+class ConnectivityMonitor:
+    """
+    Cached connectivity check.
+    targets = (host, port) pairs probed together, first to answer wins.
+    ttl = seconds a result is fresh. An older result is returned at once
+          while a background thread refreshes it.
+    The probe timeout is a few times the slowest recent RTT, kept between
+    min_timeout and max_timeout, so a dead network is detected quickly on
+    a network that normally answers fast.
+    state_file = file to share results with other processes, or None. A
+          fresh result in the file is used instead of probing, and only one
+          process at a time probes to refresh it.
+    """
+    def __init__(self, targets=TARGETS, ttl=TTL, min_timeout=MIN_TIMEOUT,
+            max_timeout=MAX_TIMEOUT, state_file=None):
+        self.targets = tuple(targets)
+        self.ttl = ttl
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.state_file = state_file
+        self.rtts = deque(maxlen=16)
+        self.result = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def timeout(self):
+        # Probe timeout adapted from the RTT history.
+        if not self.rtts:
+            return self.max_timeout
+        return min(self.max_timeout,
+                max(self.min_timeout, 4 * max(self.rtts)))
+
+    def check(self):
+        # Get a fresh result, probing if need be, and store it.
+        if self.state_file is not None:
+            return self._check_shared()
+        return self._probe()
+
+    def _probe(self):
+        # Probe now, blocking, and store the result.
+        result, rtt = probe(self.targets, self.timeout())
+        count("saytime_internet_checks_total", result=str(result).lower())
+        with self.lock:
+            if rtt is not None:
+                self.rtts.append(rtt)
+            self.result = result
+            self.checked = time.monotonic()
+            self.refreshing = False
+        return result
+
+    def _read_state(self):
+        # Adopt the shared result if it is fresh. Returns True if it was.
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            age = time.time() - state["time"]
+            result = bool(state["result"])
+            rtts = [float(rtt) for rtt in state["rtts"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if not 0 <= age <= self.ttl:
+            return False
+        with self.lock:
+            self.result = result
+            self.checked = time.monotonic() - age
+            self.rtts.clear()
+            self.rtts.extend(rtts)
+            self.refreshing = False
         return True
-    except Exception as ex:
-        #print(ex.message)
-        return False
+
+    def _write_state(self):
+        # Atomically replace the shared result with ours.
+        state = {"result": self.result, "time": time.time(),
+                "rtts": list(self.rtts)}
+        directory = os.path.dirname(self.state_file)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".saytime-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def _check_shared(self):
+        """
+        Use the shared result if fresh. Otherwise one process takes the lock
+        and probes, while the others wait for it and read its result.
+        """
+        if self._read_state():
+            return self.result
+        try:
+            lock = open(self.state_file + ".lock", "a")
+        except OSError:
+            return self._probe()
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another process is probing. Wait for it to finish.
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                if self._read_state():
+                    return self.result
+                return self._probe()
+            # Re-read, another process may have just refreshed it.
+            if self._read_state():
+                return self.result
+            result = self._probe()
+            self._write_state()
+            return result
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.check, daemon=True).start()
+
+    def is_internet(self):
+        """
+        Last result. Only the first call waits for a probe. A stale result
+        is returned as is and refreshed in the background.
+        """
+        if self.result is None:
+            with span("internet_check"):
+                return self.check()
+        if time.monotonic() - self.checked > self.ttl:
+            self._refresh_in_background()
+        return self.result
+
+    def start(self):
+        # Keep the result fresh from a background thread.
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.check()
+            self.stopped.wait(self.ttl / 2)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread = None
+
+_monitor = None
+
+def get_monitor():
+    # Shared monitor for this process, created on first use.
+    global _monitor
+    if _monitor is None:
+        _monitor = ConnectivityMonitor(state_file=STATE_FILE)
+    return _monitor
+
+def is_internet_cached():
+    # is_internet() from the shared ConnectivityMonitor.
+    return get_monitor().is_internet()
 
 if __name__ == "__main__":
 
@@ -42,6 +278,17 @@ if __name__ == "__main__":
 
     print("The internet is available: {}".format(internet_available))
 
+    start = timer()
+    internet_available = is_internet_cached()
+    end = timer()
+    print("Time taken by the monitor was {:.3f} seconds".format(end - start))
+
+    start = timer()
+    internet_available = is_internet_cached()
+    end = timer()
+    print("Time taken by the monitor again was {:.6f} seconds"
+        .format(end - start))
+
 """
 root@kepler:~# test-check-internet
 0.0867110799999864
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#!
+# espeak_backend.py
+# Requires: python3-espeak. $ apt install python3-espeak
+#
+# Speak through the python espeak module and wait for the end of each
+# message with the synth callback, instead of polling espeak.is_playing().
+# The voice and its parameters are set once per process.
+# The espeak module is only imported when first needed, see is_available().
+#
+# Example of use:
+# speaker = get_speaker()
+# speaker.say("Hello World")
+# speaker.say_all(["First sentence.", "Second sentence."])
+#
+import threading
+
+# The espeak module and its core, once imported by is_available().
+espeak = None
+espeak_core = None
+# None until is_available() has tried to import espeak.
+espeak_available = None
+
+def is_available():
+    # Import espeak on the first call. False if it is not installed.
+    global espeak, espeak_core, espeak_available
+    if espeak_available is None:
+        try:
+            from espeak import espeak as module
+            from espeak import core
+        except ImportError:
+            espeak_available = False
+        else:
+            espeak, espeak_core = module, core
+            espeak_available = True
+    return espeak_available
+
+# Change the sound of the espeak voice parameters
+#         Rate Volume Pitch Range Punctuation Capitals Wordgap
+# default[175, 100,   50,   50,   0,          0,       0]
+PARAMETERS = [220, 100, 80, 80, 0, 0, 0]
+VOICE = "en-us"
+
+class EspeakSpeaker:
+    """
+    espeak with completion events.
+    parameters = Rate, Volume, Pitch, Range, Punctuation, Capitals, Wordgap
+    voice = espeak voice name
+    """
+    def __init__(self, parameters=PARAMETERS, voice=VOICE):
+        self.parameters = list(parameters)
+        self.voice = voice
+        self.configured = False
+        self.lock = threading.Lock()
+        self.finished = threading.Condition()
+        # Messages sent to espeak that have not finished.
+        self.pending = 0
+
+    def configure(self):
+        # Set the voice, parameters and callback. Only done the first time.
+        with self.lock:
+            if self.configured:
+                return
+            if not is_available():
+                raise ImportError("python3 espeak module is not available")
+            for i, value in enumerate(self.parameters):
+                espeak.set_parameter(i + 1, value)
+            espeak.set_voice(self.voice)
+            espeak.set_SynthCallback(self._callback)
+            self.configured = True
+
+    def _callback(self, event, position, length):
+        # Called from espeak's thread for each synthesis event.
+        if event == espeak_core.event_MSG_TERMINATED:
+            with self.finished:
+                self.pending = max(0, self.pending - 1)
+                self.finished.notify_all()
+
+    def say(self, message, wait=True):
+        """
+        Queue a message after any already queued.
+        wait = block until everything queued has been spoken.
+        """
+        self.configure()
+        with self.finished:
+            self.pending += 1
+        if not espeak.synth(message):
+            with self.finished:
+                self.pending = max(0, self.pending - 1)
+                self.finished.notify_all()
+        if wait:
+            self.wait()
+
+    def say_all(self, messages):
+        # Speak several messages back to back and wait for the last.
+        for message in messages:
+            self.say(message, wait=False)
+        self.wait()
+
+    def wait(self, timeout=None):
+        # Wait until everything queued has been spoken. False on timeout.
+        with self.finished:
+            return self.finished.wait_for(lambda: self.pending == 0, timeout)
+
+    def cancel(self):
+        # Stop speaking and drop anything queued.
+        if self.configured:
+            espeak.cancel()
+        with self.finished:
+            self.pending = 0
+            self.finished.notify_all()
+
+_speaker = None
+
+def get_speaker(parameters=PARAMETERS, voice=VOICE):
+    """
+    Shared speaker for this process. The parameters and voice given on the
+    first call are the ones used.
+    """
+    global _speaker
+    if _speaker is None:
+        _speaker = EspeakSpeaker(parameters, voice)
+    return _speaker
+
+if __name__ == "__main__":
+
+    import sys
+    if not is_available():
+        sys.exit("python3 espeak module is not available")
+    get_speaker().say_all(sys.argv[1:] or ["espeak backend.", "Done."])
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#!
+# fragments.py
+#
+# Speak the time by joining short cached pieces of audio instead of caching
+# every whole sentence. Each saytime phrase is made of the same few parts:
+#
+# The time is | just after | ten past | three | in the afternoon
+# February | the | 14th | of | 2019 | is | Thursday | and | the time is ...
+#
+# so about a hundred fragments per language cover every announcement. Each
+# fragment is fetched once through the gspeak cache, decoded to PCM by
+# pcm_store.py and trimmed of leading and trailing silence. An announcement
+# is the fragments' samples joined with a short crossfade.
+#
+# Example of use:
+# say_fragments(15, 12)          # The time is just after ten past three ...
+# say_fragments(15, 12, True)    # With the date
+#
+# $ fragments.py --language en-au    # fetch and decode every fragment
+#
+import sys
+import time
+from array import array
+from datetime import date
+try:
+    from pylib.saytime_phrase import (five_minute_list, how_near_list,
+            hour_list, time_of_day, get_five_minute, get_hour,
+            get_time_of_day, get_day_suffix)
+    from pylib.pcm_store import get_store, decode, RATE
+    from pylib.speech_queue import say_pcm, NORMAL
+    from pylib.audio_cache import get_cache
+    from pylib.gspeak import fetch_mp3
+    from pylib.voice_pack import lookup
+except ImportError:
+    from saytime_phrase import (five_minute_list, how_near_list,
+            hour_list, time_of_day, get_five_minute, get_hour,
+            get_time_of_day, get_day_suffix)
+    from pcm_store import get_store, decode, RATE
+    from speech_queue import say_pcm, NORMAL
+    from audio_cache import get_cache
+    from gspeak import fetch_mp3
+    from voice_pack import lookup
+
+CROSSFADE = int(RATE * 0.015)
+# Samples quieter than this at either end of a fragment are trimmed.
+SILENCE = 300
+# Silence kept at each end of a trimmed fragment, so words do not run on.
+PADDING = int(RATE * 0.03)
+
+MONTHS = ("January", "February", "March", "April", "May", "June", "July",
+        "August", "September", "October", "November", "December")
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+        "Saturday", "Sunday")
+LINKS = ("The time is", "the time is", "the", "of", "is", "and")
+
+def get_time_fragments(hour, minute, verbose=False, day=None):
+    """
+    The fragments of the phrase for hour and minute, in speaking order.
+    verbose = start with the date. day = datetime.date, default today.
+    """
+    near_message, five_minute_message = get_five_minute(minute)
+    time_fragments = [near_message, five_minute_message,
+            get_hour(hour, minute), get_time_of_day(hour)]
+    if not verbose:
+        return ["The time is"] + time_fragments
+    if day is None:
+        day = date.today()
+    return [MONTHS[day.month - 1], "the", get_day_suffix(day.day), "of",
+            str(day.year), "is", WEEKDAYS[day.weekday()], "and",
+            "the time is"] + time_fragments
+
+def list_fragments(years=None):
+    # Every fragment saytime can need, without duplicates.
+    if years is None:
+        years = (date.today().year, date.today().year + 1)
+    fragments = list(LINKS) + how_near_list + five_minute_list + hour_list
+    fragments += time_of_day + list(MONTHS) + list(WEEKDAYS)
+    fragments += [get_day_suffix(day) for day in range(1, 32)]
+    fragments += [str(year) for year in years]
+    return list(dict.fromkeys(fragments))
+
+def trim(samples):
+    # Remove silence from both ends, keeping PADDING samples of it.
+    start = 0
+    end = len(samples)
+    while start < end and abs(samples[start]) < SILENCE:
+        start += 1
+    while end > start and abs(samples[end - 1]) < SILENCE:
+        end -= 1
+    return samples[max(0, start - PADDING):min(len(samples), end + PADDING)]
+
+def to_samples(pcm_data):
+    # Little-endian 16 bit PCM bytes (or a memoryview) to an array of samples.
+    samples = array("h")
+    samples.frombytes(pcm_data)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+def to_bytes(samples):
+    if sys.byteorder == "big":
+        samples = array("h", samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+# (fragment, language) : trimmed samples
+_samples = {}
+
+def get_fragment(fragment, language="en"):
+    """
+    Samples for one fragment: from memory, the voice pack, the PCM store,
+    the mp3 cache, or google, in that order.
+    """
+    key = (fragment, language)
+    samples = _samples.get(key)
+    if samples is not None:
+        return samples
+    pcm_data = lookup(fragment, language, "pcm")
+    if pcm_data is None:
+        pcm_data = get_store().get(fragment, language)
+    if pcm_data is None:
+        mp3_data = get_cache().get(fragment, language)
+        if mp3_data is None:
+            mp3_data = fetch_mp3(fragment, language)
+            get_cache().put(fragment, language, mp3_data)
+        pcm_data = decode(mp3_data)
+        get_store().put(fragment, language, pcm_data)
+    samples = _samples[key] = trim(to_samples(pcm_data))
+    return samples
+
+def crossfade(first, second, length=CROSSFADE):
+    # Join two arrays of samples, overlapping length samples with linear fades.
+    length = min(length, len(first), len(second))
+    joined = first[:len(first) - length]
+    tail = first[len(first) - length:]
+    for i in range(length):
+        weight = (i + 1) / (length + 1)
+        joined.append(int(tail[i] * (1 - weight) + second[i] * weight))
+    joined.extend(second[length:])
+    return joined
+
+def assemble(fragments, language="en"):
+    # PCM bytes for the fragments spoken one after the other.
+    samples = array("h")
+    for fragment in fragments:
+        samples = crossfade(samples, get_fragment(fragment, language))
+    return to_bytes(samples)
+
+def say_fragments(hour, minute, verbose=False, language="en", wait=True,
+        priority=NORMAL, max_delay=None):
+    # Speak the time from fragments through the PCM sink, via the speech
+    # queue. Returns the speech queue status.
+    pcm_data = assemble(get_time_fragments(hour, minute, verbose), language)
+    return say_pcm(pcm_data, priority, max_delay, wait)
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(
+            description="Fetch and decode every saytime fragment.")
+    parser.add_argument("--language", default="en")
+    args = parser.parse_args()
+
+    fragments = list_fragments()
+    start = time.monotonic()
+    failed = 0
+    for fragment in fragments:
+        try:
+            get_fragment(fragment, args.language)
+        except Exception as e:
+            failed += 1
+            sys.stderr.write("{}: {}\n".format(fragment, e))
+    print("{} fragments, {} failed, {:.1f} seconds".format(len(fragments),
+            failed, time.monotonic() - start))
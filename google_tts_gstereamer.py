@@ -6,16 +6,32 @@
 #
 # This uses a loop and needs call_back() function(s) for EOS, etc.
 #
+# GstPlayer keeps one playbin and loop for the life of the program and plays
+# a queue of uris without gaps between them.
+# GstBufferPlayer plays mp3 or PCM data already in memory through appsrc.
+# $ google_tts_gstereamer.py --test-buffer clip.mp3   # plays it twice
+#
 # Demonstration of using google translate text to speech feature.
 # Will also play a local mp3 file. E.g. yakety_yak.mp3
 #
+# gi and GStreamer are imported when first needed, by load_gst(), so
+# importing this module is quick and works without them.
+#
 # Ian Stewart - 2020-03-25
 # Importing...
-import gi
-gi.require_version('Gst', '1.0')
-gi.require_version('GLib', '2.0')
-from gi.repository import Gst, GLib
 import sys
+import urllib.parse
+from collections import deque, OrderedDict
+try:
+    from pylib.audio_cache import get_cache
+    from pylib.voice_pack import lookup
+    from pylib.speech_queue import get_queue, NORMAL
+    from pylib.metrics import span, count, ERRORS, FALLBACKS
+except ImportError:
+    from audio_cache import get_cache
+    from voice_pack import lookup
+    from speech_queue import get_queue, NORMAL
+    from metrics import span, count, ERRORS, FALLBACKS
 
 
 # Brief uri as default when calling main().
@@ -25,7 +41,48 @@ URI += 'ie=UTF-8&client=tw-ob&tl={}&q={}'
 #URI_COMPOSED = URI.format("en-UK", "This should be with a British accent.")
 URI_COMPOSED = URI.format("en-US", "This should be with an American accent.")
 
+# Times a uri is re-tried after a playbin ERROR before moving on.
+RETRIES = 2
+
+# appsrc pipelines for audio already in memory. Encoded data, e.g. mp3, is
+# found and decoded by decodebin. Raw PCM goes straight to the sink.
+# decodebin's output pad is made anew each time the pipeline plays, so it is
+# linked to audioconvert by GstBufferPlayer, not by parse_launch, which
+# would link only the first one.
+ENCODED_PIPELINE = ("appsrc name=src format=bytes ! decodebin name=decode "
+        "audioconvert name=convert ! audioresample ! autoaudiosink")
+PCM_PIPELINE = ("appsrc name=src format=time caps={} ! "
+        "audioconvert ! audioresample ! autoaudiosink")
+PCM_CAPS = "audio/x-raw,format=S16LE,layout=interleaved,rate={},channels={}"
+# Number of clips kept in memory by play_message()
+CLIP_CACHE_SIZE = 64
+
+# gi.repository modules, set by load_gst()
+Gst = None
+GLib = None
+
+def load_gst():
+    # Import and initialize GStreamer on the first call.
+    global Gst, GLib
+    if Gst is None:
+        import gi
+        gi.require_version('Gst', '1.0')
+        gi.require_version('GLib', '2.0')
+        from gi.repository import Gst as gst, GLib as glib
+        gst.init(None)
+        Gst, GLib = gst, glib
+    return Gst
+
 def main(uri=URI_COMPOSED):
+    """
+    Requires the uri to be passed.   
+    Play it with the shared GstPlayer, which is initialized on first use and
+    then re-used. It waits its turn in the speech queue.
+    """
+    play_uris([uri])
+
+
+def main_once(uri=URI_COMPOSED):
     """
     Requires the uri to be passed.   
     Initialize: Gst, Instantiate playbin, and get rid of video. loop and bus.
@@ -59,8 +116,27 @@ def initialize():
     """
     # Init
     #GObject.threads_init()
-    Gst.init(None)
+    load_gst()
+
+    player = make_playbin()
+
+    # Instantiate the event loop.
+    #loop = GObject.MainLoop() <-- deprecated, use GLib
+    loop = GLib.MainLoop()
+
+    # Instantiate and initialize the bus call-back 
+    bus = player.get_bus()
+    bus.add_signal_watch()
+    bus.connect ("message", bus_call, loop)
 
+    return player, loop
+
+
+def make_playbin():
+    """
+    Instantiate playbin with a fakesink to bury any video.
+    """
+    load_gst()
     # Instantiate    
     #player = Gst.ElementFactory.make("playbin", 'player')
 
@@ -73,25 +149,16 @@ def initialize():
     # Stop video. Only sending audio to playbin
     fakesink = Gst.ElementFactory.make("fakesink", "fakesink")
     player.set_property("video-sink", fakesink)
+    return player
 
-    # Instantiate the event loop.
-    #loop = GObject.MainLoop() <-- deprecated, use GLib
-    loop = GLib.MainLoop()
-
-    # Instantiate and initialize the bus call-back 
-    bus = player.get_bus()
-    bus.add_signal_watch()
-    bus.connect ("message", bus_call, loop)
-
-    return player, loop
 
-
-def bus_call(bus, message, loop):
+def bus_call(bus, message, loop, on_eos=None, on_error=None):
     """
     Call back for messages generated when playbin is playing.
     The End-of-Stream, EOS, message indicates the audio is complete and the
     waiting loop is quit.
-    Note: could havre multiple call_back()'s. One for EOS, one for ERROR, etc.
+    on_eos, on_error = optional functions called on EOS or ERROR. If they
+    return True they have dealt with the message and the loop is not quit.
     """
     t = message.type
     #print(t)
@@ -100,24 +167,281 @@ def bus_call(bus, message, loop):
         # End-of-Stream therefore quit loop which executes playbin state Null
         #sys.stdout.write("End-of-stream\n")
         #print(t) # <flags GST_MESSAGE_EOS of type Gst.MessageType>
-        loop.quit()
+        if on_eos is None or not on_eos():
+            loop.quit()
 
     elif t == Gst.MessageType.ERROR:
         err, debug = message.parse_error()
-        # TODO: If error then re-try last message
         sys.stderr.write("Error: %s: %s\n" % (err, debug))
-        loop.quit()
+        count(ERRORS, stage="gstreamer", cause=err.domain)
+        if on_error is None or not on_error():
+            loop.quit()
 
     return True
 
 
+class GstPlayer:
+    """
+    One playbin and main loop, initialized once and re-used for every uri.
+    Queued uris are handed to playbin from its about-to-finish signal, so
+    they follow each other without a gap. A uri that gives an ERROR is
+    re-tried up to retries times.
+    """
+    def __init__(self, retries=RETRIES):
+        load_gst()
+        self.retries = retries
+        self.queue = deque()
+        self.current = None
+        self.attempts = 0
+        self.player = make_playbin()
+        self.player.connect("about-to-finish", self.about_to_finish)
+        self.loop = GLib.MainLoop()
+        bus = self.player.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", bus_call, self.loop, self.on_eos,
+                self.on_error)
+
+    def set_uri(self, uri):
+        self.current = uri
+        self.attempts = 0
+        self.player.set_property('uri', uri)
+
+    def about_to_finish(self, player):
+        # Called from the streaming thread near the end of the current uri.
+        # Setting the next uri now makes playbin continue without a gap.
+        if self.queue:
+            self.set_uri(self.queue.popleft())
+
+    def on_eos(self):
+        # The last queued uri has finished. Keep the pipeline for next time.
+        self.player.set_state(Gst.State.READY)
+        return False
+
+    def on_error(self):
+        # Re-try the uri that failed, then go on to the next one.
+        self.player.set_state(Gst.State.READY)
+        if self.attempts < self.retries:
+            self.attempts += 1
+            count(FALLBACKS, stage="gstreamer", cause="retry")
+            self.player.set_property('uri', self.current)
+        elif self.queue:
+            count(FALLBACKS, stage="gstreamer", cause="skip")
+            self.set_uri(self.queue.popleft())
+        else:
+            return False
+        self.player.set_state(Gst.State.PLAYING)
+        return True
+
+    def play(self, uris):
+        """
+        Play a list of uris one after the other and wait for the last.
+        """
+        self.queue.extend(uris)
+        if not self.queue:
+            return
+        self.set_uri(self.queue.popleft())
+        with span("gst_play"):
+            self.player.set_state(Gst.State.PLAYING)
+            self.loop.run()
+
+    def stop(self):
+        # Called from another thread. Drop the queue and make play() return.
+        self.queue.clear()
+        self.player.set_state(Gst.State.READY)
+        self.loop.quit()
+
+    def close(self):
+        self.queue.clear()
+        self.player.set_state(Gst.State.NULL)
+
+
+def link_decoded(decodebin, pad, convert):
+    # decodebin pad-added: link the decoded audio to audioconvert. Called
+    # for every play, as going to READY removes decodebin's pads.
+    sink = convert.get_static_pad("sink")
+    if (not sink.is_linked() and
+            pad.query_caps(None).to_string().startswith("audio/")):
+        pad.link(sink)
+
+
+class GstBufferPlayer:
+    """
+    Play bytes already in memory through an appsrc pipeline, with no uri,
+    network or temporary file. A pipeline is built once for each format and
+    re-used. EOS and ERROR go through bus_call() as for playbin.
+    """
+    def __init__(self):
+        load_gst()
+        self.loop = GLib.MainLoop()
+        # caps (None for encoded data) : (pipeline, appsrc)
+        self.pipelines = {}
+        # Set by an ERROR during the last play_bytes().
+        self.failed = False
+
+    def on_error(self):
+        self.failed = True
+        return False
+
+    def get_pipeline(self, caps):
+        if caps not in self.pipelines:
+            if caps is None:
+                pipeline = Gst.parse_launch(ENCODED_PIPELINE)
+                pipeline.get_by_name("decode").connect("pad-added",
+                        link_decoded, pipeline.get_by_name("convert"))
+            else:
+                pipeline = Gst.parse_launch(PCM_PIPELINE.format(caps))
+            bus = pipeline.get_bus()
+            bus.add_signal_watch()
+            bus.connect("message", bus_call, self.loop, None, self.on_error)
+            self.pipelines[caps] = (pipeline, pipeline.get_by_name("src"))
+        return self.pipelines[caps]
+
+    def play_bytes(self, data, caps=None, duration=None):
+        """
+        Play data and wait for it to finish.
+        caps = None for encoded data such as mp3, or a raw audio caps string
+               such as PCM_CAPS.format(24000, 1)
+        duration = length of raw audio in nanoseconds, if known.
+        Returns False if GStreamer reported an error.
+        """
+        if duration is None:
+            duration = Gst.CLOCK_TIME_NONE
+        pipeline, src = self.get_pipeline(caps)
+        buffer = Gst.Buffer.new_wrapped(data)
+        if caps is not None:
+            buffer.pts = 0
+            buffer.duration = duration
+        self.failed = False
+        with span("gst_play"):
+            pipeline.set_state(Gst.State.PLAYING)
+            src.emit("push-buffer", buffer)
+            src.emit("end-of-stream")
+            self.loop.run()
+        # READY clears the EOS so the pipeline can be used again.
+        pipeline.set_state(Gst.State.READY)
+        return not self.failed
+
+    def play_pcm(self, pcm_data, rate=24000, channels=1):
+        # Play signed 16 bit little-endian interleaved samples.
+        duration = (len(pcm_data) // (2 * channels)) * Gst.SECOND // rate
+        return self.play_bytes(pcm_data, PCM_CAPS.format(rate, channels),
+                duration)
+
+    def stop(self):
+        # Called from another thread. Make play_bytes() return.
+        for pipeline, src in self.pipelines.values():
+            pipeline.set_state(Gst.State.READY)
+        self.loop.quit()
+
+    def close(self):
+        for pipeline, src in self.pipelines.values():
+            pipeline.set_state(Gst.State.NULL)
+        self.pipelines = {}
+
+
+_player = None
+_buffer_player = None
+# (message, language) : mp3 data, most recently used last.
+_clips = OrderedDict()
+
+def get_player():
+    # Shared GstPlayer, created on first use.
+    global _player
+    if _player is None:
+        _player = GstPlayer()
+    return _player
+
+def get_buffer_player():
+    # Shared GstBufferPlayer, created on first use.
+    global _buffer_player
+    if _buffer_player is None:
+        _buffer_player = GstBufferPlayer()
+    return _buffer_player
+
+def test_buffer_player(path, repeat=2):
+    """
+    Play an mp3 file back to back through one GstBufferPlayer, as the
+    re-used pipeline must play every clip, not just the first. Prints the
+    time each took, and returns False if any failed. An unlinked decodebin
+    fails with "not-negotiated" or "not-linked".
+    """
+    import time
+    with open(path, "rb") as f:
+        data = f.read()
+    player = GstBufferPlayer()
+    ok = True
+    for n in range(1, repeat + 1):
+        start = time.monotonic()
+        played = player.play_bytes(data)
+        seconds = time.monotonic() - start
+        print("play {}: {} in {:.2f} seconds".format(n,
+                "ok" if played else "FAILED", seconds))
+        ok = ok and played
+    player.close()
+    return ok
+
+def play_uris(uris, priority=NORMAL, max_delay=None):
+    # Play uris through the speech queue. Returns the speech_queue status.
+    player = get_player()
+    return get_queue().say(lambda: player.play(uris), player.stop, priority,
+            max_delay, "gstreamer")
+
+def play_buffer(data, priority=NORMAL, max_delay=None):
+    # Play in-memory data through the speech queue.
+    player = get_buffer_player()
+    return get_queue().say(lambda: player.play_bytes(data), player.stop,
+            priority, max_delay, "gstreamer")
+
+def speak(text, language="en", priority=NORMAL, max_delay=None):
+    """
+    Speak text of any length. It is split into pieces short enough for
+    translate_tts, and playbin streams them one after the other without gaps.
+    """
+    try:
+        from pylib.gspeak import split_text
+    except ImportError:
+        from gspeak import split_text
+    return play_uris([URI.format(language, urllib.parse.quote_plus(chunk))
+            for chunk in split_text(text)], priority, max_delay)
+
+def play_message(message, language="en", priority=NORMAL, max_delay=None):
+    """
+    Speak message. Clips already held in memory, in the voice pack or in
+    the gspeak audio cache are pushed straight into an appsrc. Otherwise
+    stream from google through playbin.
+    """
+    key = (message, language)
+    mp3_data = _clips.get(key)
+    if mp3_data is None:
+        mp3_data = lookup(message, language)
+        if mp3_data is not None:
+            # Gst.Buffer.new_wrapped() needs bytes.
+            mp3_data = bytes(mp3_data)
+    if mp3_data is None:
+        mp3_data = get_cache().get(message, language)
+    if mp3_data is None:
+        return play_uris([URI.format(language,
+                urllib.parse.quote_plus(message))], priority, max_delay)
+    _clips[key] = mp3_data
+    _clips.move_to_end(key)
+    while len(_clips) > CLIP_CACHE_SIZE:
+        _clips.popitem(last=False)
+    return play_buffer(mp3_data, priority, max_delay)
+
+
 if __name__=="__main__":
 
+    # $ google_tts_gstereamer.py --test-buffer clip.mp3
+    if len(sys.argv) == 3 and sys.argv[1] == "--test-buffer":
+        sys.exit(0 if test_buffer_player(sys.argv[2]) else 1)
+
     #main()
     
-    main(URI.format("en-au", "G'day. I speak with an Australian accent."))
-    main(URI.format("en-UK", "Good morning. I speak with a British accent."))
-    main(URI.format("en-US", "Howdie. I speak with an American accent."))   
+    # One playbin for all three, played without gaps.
+    get_player().play([
+        URI.format("en-au", "G'day. I speak with an Australian accent."),
+        URI.format("en-UK", "Good morning. I speak with a British accent."),
+        URI.format("en-US", "Howdie. I speak with an American accent.")])
 
     sys.exit()
     
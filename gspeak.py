@@ -5,65 +5,353 @@
 #
 # Accept a string of text as an argument, send it to google translate,
 # the returned .mp3 data is fed to mpv to produce the audio. 
+# The mp3 data is kept in an on-disk cache (audio_cache.py) so a message
+# that has been spoken before plays without a network round trip.
+# Playback goes to one long-lived mpv (mpv_player.py) when it can be started.
+# Requests share kept-alive connections (http_session.py).
+# A clip in an installed voice pack (voice_pack.py) is used before either.
+# Text longer than google accepts is split at sentence and clause boundaries
+# and the pieces fetched in parallel, then played in order.
+# Everything played waits its turn in the speech queue (speech_queue.py).
+# Each stage is timed, and errors counted, when metrics.py is enabled.
+# Fetches have timeouts, retries, hedging and a circuit breaker
+# (resilient_fetch.py). While the circuit is open fetches fail at once.
 #
 # Call via bash or install as a python module.
 #
 # Ian Stewart - March 2019
 #
+import re
 import sys
+import time
+import socket
 import subprocess
+import urllib.error
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-def gspeak(message='Hello World', language='en'):
+try:
+    from pylib.audio_cache import get_cache
+    from pylib.mpv_player import get_player, PlayerError
+    from pylib.voice_pack import lookup
+    from pylib.single_flight import SingleFlight
+    from pylib.speech_queue import get_queue, say_mp3, NORMAL
+    from pylib.metrics import span, count, ERRORS, FALLBACKS
+except ImportError:
+    from audio_cache import get_cache
+    from mpv_player import get_player, PlayerError
+    from voice_pack import lookup
+    from single_flight import SingleFlight
+    from speech_queue import get_queue, say_mp3, NORMAL
+    from metrics import span, count, ERRORS, FALLBACKS
+
+URL = 'https://translate.google.com/translate_tts'
+USER_AGENT = 'Mozilla'
+# mpv seems to work better than mplayer. Doesn't have connect messages 
+MPV_STDIN_ARGS = ("mpv", "-cache", "1024", "-really-quiet", "/dev/stdin")
+# Bytes forwarded to mpv at a time when streaming.
+CHUNK_SIZE = 4096
+# Longest text translate_tts accepts. Longer messages are split into chunks
+# that are fetched at the same time by FETCH_WORKERS threads.
+MAX_CHARS = 200
+FETCH_WORKERS = 4
+
+# Timings of the last streamed message, in seconds from sending the request:
+# first_byte = first mp3 data received from google
+# first_audio = first mp3 data handed to mpv
+# total = whole message received and handed to mpv
+last_timing = {}
+
+HEADERS = { 'User-Agent' : USER_AGENT }
+
+_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+# Concurrent fetches of the same (message, language) share one request.
+_flights = SingleFlight()
+
+def split_text(text, limit=MAX_CHARS):
     """
-    Use google translate to do text to speech translation.
-    Use mpv to play the mp3 data.
-    message = text to be converted to speech
-    language = en is English, fr is French, de is German, etc.
+    Split text into chunks of at most limit characters. Break at the end of
+    a sentence if possible, then at a clause (, ; :), then between words.
     """
-    # Build the url string.
-    url = 'https://translate.google.com/translate_tts'
-    user_agent = 'Mozilla'
+    chunks = []
+    for pattern in (r"(?<=[.!?])\s+", r"(?<=[,;:])\s+", r"\s+", None):
+        if pattern is None:
+            # A single word longer than the limit.
+            return [chunk[i:i + limit] for chunk in chunks
+                    for i in range(0, len(chunk), limit)]
+        pieces = chunks or [text.strip()]
+        chunks = []
+        for piece in pieces:
+            if len(piece) <= limit:
+                chunks.append(piece)
+                continue
+            # Re-join the parts of a too long piece up to the limit.
+            current = ""
+            for part in re.split(pattern, piece):
+                if current and len(current) + 1 + len(part) > limit:
+                    chunks.append(current)
+                    current = part
+                else:
+                    current = current + " " + part if current else part
+            if current:
+                chunks.append(current)
+        if all(len(chunk) <= limit for chunk in chunks):
+            return chunks
+
+def build_url(message, language='en'):
+    # Build the url string for google translate.
     values = {'tl' : language,
               'client' : 'tw-ob',
               'ie' : 'UTF-8',
               'q' : message }
 
     data = urllib.parse.urlencode(values)
-    headers = { 'User-Agent' : user_agent }
+    return URL + "?" + data
 
-    req = urllib.request.Request(url + "?" + data, None, headers)
+def build_request(message, language='en'):
+    # Build a urllib request for google translate.
+    import urllib.request
+    return urllib.request.Request(build_url(message, language), None, HEADERS)
 
-    # mpv seems to work better than mplayer. Doesn't have connect messages 
-    player = subprocess.Popen \
-      (
-        args = ("mpv", "-cache", "1024", "-really-quiet", "/dev/stdin"),
-        stdin = subprocess.PIPE
-       )
-    # Send the request to google, and send mp3 data to mp3 player.
+def get_fetcher():
+    # The shared resilient_fetch.Fetcher. It, and with it http.client and
+    # ssl, is only imported when something has to be fetched.
     try:
-        with urllib.request.urlopen(req) as response:
-            mp3_data = response.read()
-            player.stdin.write(mp3_data)
+        from pylib.resilient_fetch import get_fetcher
+    except ImportError:
+        from resilient_fetch import get_fetcher
+    return get_fetcher()
+
+def fetch_mp3(message='Hello World', language='en'):
+    # Send the request to google and return the mp3 data. If the same
+    # message is already being fetched, wait for that request instead.
+    return _flights.do((message, language), download_mp3, message, language)
+
+def download_mp3(message='Hello World', language='en'):
+    # Send the request to google and return the mp3 data.
+    # The connection is kept open for the next message.
+    with span("build_url"):
+        url = build_url(message, language)
+    with span("download"):
+        return get_fetcher().fetch(url, HEADERS)
+
+def spawn_mpv(mp3_data):
+    # Start an mpv for this message only, and feed it the mp3 data.
+    player = subprocess.Popen(args=MPV_STDIN_ARGS, stdin=subprocess.PIPE)
+    player.stdin.write(mp3_data)
+    player.stdin.close()
+    player.wait() # fixme: should check return status
+
+def stream_mp3(message='Hello World', language='en', chunk_size=CHUNK_SIZE):
+    """
+    Send the request to google and feed the mp3 data to a new mpv chunk by
+    chunk as it arrives, so playback starts before the download finishes.
+    Writes to mpv's stdin block while its pipe is full, which holds back
+    reading from google until mpv catches up.
+    Returns the whole mp3 data, e.g. for the cache.
+    Raises CircuitOpen at once while google is failing, without an mpv.
+    """
+    start = time.monotonic()
+    timing = {}
+    chunks = []
+    player = None
+    try:
+        with get_fetcher().stream(build_url(message, language), HEADERS) \
+                as read:
+            # mpv is started once google has answered, so a failed request
+            # does not start one. Its startup overlaps the body arriving.
+            player = subprocess.Popen(args=MPV_STDIN_ARGS,
+                    stdin=subprocess.PIPE)
+            while True:
+                chunk = read(chunk_size)
+                if not chunk:
+                    break
+                if not chunks:
+                    timing["first_byte"] = time.monotonic() - start
+                chunks.append(chunk)
+                player.stdin.write(chunk)
+                player.stdin.flush()
+                if "first_audio" not in timing:
+                    timing["first_audio"] = time.monotonic() - start
+        timing["total"] = time.monotonic() - start
+    finally:
+        last_timing.clear()
+        last_timing.update(timing)
+        if player is not None:
+            try:
+                player.stdin.close()
+            except BrokenPipeError:
+                pass
+            player.wait()
+    return b"".join(chunks)
+
+def play_mp3(mp3_data, persistent=True, suffix=".mp3", priority=NORMAL,
+        max_delay=None):
+    """
+    Play mp3 data through the speech queue and wait for it to finish.
+    persistent = use the long-lived mpv in mpv_player.py. If it can not be
+                 started, fall back to an mpv for this message only.
+    suffix = file type of the data, for any other format mpv can play.
+    priority = speech_queue priority. A more urgent one interrupts it.
+    max_delay = seconds it may wait in the queue before being dropped.
+    Returns the speech_queue status, e.g. "played" or "dropped".
+    """
+    with span("play"):
+        if persistent:
+            try:
+                return say_mp3(mp3_data, priority, max_delay, suffix)
+            except PlayerError:
+                count(FALLBACKS, stage="play", cause="PlayerError")
+        return get_queue().say(lambda: spawn_mpv(mp3_data), None, priority,
+                max_delay, "mpv")
+
+def get_mp3(message, language='en', cache=True):
+    # mp3 data from the voice pack, the cache, or google, in that order.
+    mp3_data = lookup(message, language)
+    if mp3_data is None and cache:
+        mp3_data = get_cache().get(message, language)
+    if mp3_data is None:
+        mp3_data = fetch_mp3(message, language)
+        if cache:
+            get_cache().put(message, language, mp3_data)
+    return mp3_data
+
+def speak_chunks(chunks, language='en', cache=True, persistent=True,
+        priority=NORMAL, max_delay=None):
+    """
+    Fetch all chunks at the same time, and play them strictly in order,
+    starting as soon as the first has arrived. The chunks are one entry in
+    the speech queue.
+    """
+    futures = [_executor.submit(get_mp3, chunk, language, cache)
+            for chunk in chunks]
+    player = None
+    if persistent:
+        try:
+            player = get_player()
+            player.ensure_running()
+        except PlayerError:
+            count(FALLBACKS, stage="play", cause="PlayerError")
+            player = None
+    stopped = []
+
+    def play_persistent():
+        # Queued on the long-lived mpv's playlist, back to back.
+        for future in futures:
+            if stopped:
+                return
+            player.play_bytes(future.result(), wait=False)
+        player.wait()
+
+    def stop_persistent():
+        stopped.append(True)
+        player.stop()
+
+    def play_spawned():
+        # One mpv for all chunks. mp3 data can simply be joined.
+        process = subprocess.Popen(args=MPV_STDIN_ARGS, stdin=subprocess.PIPE)
+        try:
+            for future in futures:
+                process.stdin.write(future.result())
+                process.stdin.flush()
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    try:
+        if player is not None:
+            get_queue().say(play_persistent, stop_persistent, priority,
+                    max_delay, "mpv")
+        else:
+            get_queue().say(play_spawned, None, priority, max_delay, "mpv")
+    finally:
+        for future in futures:
+            future.cancel()
+
+def gspeak(message='Hello World', language='en', cache=True, persistent=True,
+        stream=False, priority=NORMAL, max_delay=None):
+    """
+    Use google translate to do text to speech translation.
+    Use mpv to play the mp3 data.
+    message = text to be converted to speech
+    language = en is English, fr is French, de is German, etc.
+    cache = re-use mp3 data from the on-disk cache. On a miss the data
+            fetched from google is stored for next time.
+    persistent = play through one long-lived mpv rather than a new mpv for
+                 each message.
+    stream = on a cache miss, play the mp3 data while it is downloading,
+             through a new mpv. Timings are kept in last_timing.
+    priority = speech_queue priority, URGENT interrupts anything less urgent.
+    max_delay = seconds the message may wait to be spoken before it is
+                dropped as out of date. None to always speak it.
+    A message longer than MAX_CHARS is split up and the pieces fetched at
+    the same time, see speak_chunks().
+    """
+    with span("gspeak"):
+        _gspeak(message, language, cache, persistent, stream, priority,
+                max_delay)
+
+def _gspeak(message, language, cache, persistent, stream, priority,
+        max_delay):
+    chunks = split_text(message)
+    if len(chunks) > 1:
+        try:
+            speak_chunks(chunks, language, cache, persistent, priority,
+                    max_delay)
+        except urllib.error.URLError as e:
+            count(ERRORS, stage="gspeak", cause=type(e).__name__)
+            print("gspeak error: urllib.error.URLError - check network connection")
+        except Exception as e:
+            count(ERRORS, stage="gspeak", cause=type(e).__name__)
+            print("gspeak error: {} - check network connection.".format(
+                    type(e).__name__))
+        return
+
+    # An installed voice pack comes first, then the cache.
+    with span("lookup"):
+        mp3_data = lookup(message, language)
+        if mp3_data is None and cache:
+            mp3_data = get_cache().get(message, language)
+
+    # On a cache miss send the request to google.
+    try:
+        if mp3_data is None and stream:
+            streamed = []
+            get_queue().say(lambda: streamed.append(stream_mp3(message,
+                    language)), None, priority, max_delay, "mpv")
+            if cache and streamed:
+                get_cache().put(message, language, streamed[0])
+            return
+
+        if mp3_data is None:
+            mp3_data = fetch_mp3(message, language)
+            if cache:
+                get_cache().put(message, language, mp3_data)
 
     except urllib.error.URLError as e:
+        count(ERRORS, stage="gspeak", cause=type(e).__name__)
         #print(e)
         #print(e.reason)
         #print(e.read())
         print("gspeak error: urllib.error.URLError - check network connection")
+        return
 
     except socket.gaierror as e:
+        count(ERRORS, stage="gspeak", cause=type(e).__name__)
         #print(e)
         #print(e.reason)
         #print(e.read())
         print("gspeak error: socket.gaierror - check network connection")
+        return
 
-    except:
-        print("gspeak error: Unknown - check network connection.")
+    except Exception as e:
+        count(ERRORS, stage="gspeak", cause=type(e).__name__)
+        print("gspeak error: {} - check network connection.".format(
+                type(e).__name__))
+        return
 
-    player.stdin.close()
-    player.wait() # fixme: should check return status
+    # Send mp3 data to mp3 player.
+    play_mp3(mp3_data, persistent, priority=priority, max_delay=max_delay)
 
 
 if __name__=="__main__":
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+#!
+# http_session.py
+#
+# Reusable HTTP/1.1 client for gspeak. Connections are kept open per
+# (scheme, host, port) and re-used by the next request, so back to back
+# messages pay for one TCP+TLS handshake instead of one each. Host names
+# are resolved once and kept for DNS_TTL seconds. Connecting and reading
+# have separate timeouts, so an unreachable host fails in CONNECT_TIMEOUT.
+#
+# A kept connection the server has since closed is detected when the
+# request fails, and the request is sent once more on a new connection.
+#
+# Errors are raised as urllib.error.URLError / HTTPError, the same as
+# urllib.request.urlopen(), so callers can handle either.
+#
+# Example of use:
+# session = get_session()
+# with session.get("https://translate.google.com/translate_tts?...",
+#         {"User-Agent": "Mozilla"}) as response:
+#     mp3_data = response.read()
+#
+import time
+import socket
+import threading
+import contextlib
+import http.client
+import urllib.error
+import urllib.parse
+try:
+    from pylib.metrics import span
+except ImportError:
+    from metrics import span
+
+DNS_TTL = 300
+# Seconds a kept connection may be idle before it is closed, not re-used.
+IDLE_TIMEOUT = 60
+# Seconds to connect, and to wait for each read (TLS handshake included).
+CONNECT_TIMEOUT = 2.0
+READ_TIMEOUT = 5.0
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+class DnsCache:
+    """
+    getaddrinfo() results kept for ttl seconds.
+    """
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        # List of (family, sockaddr) for host and port.
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((host, port))
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        with span("dns"):
+            addresses = [(family, sockaddr) for family, type_, proto, name,
+                    sockaddr in socket.getaddrinfo(host, port,
+                    type=socket.SOCK_STREAM)]
+        with self.lock:
+            self.entries[(host, port)] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host, port):
+        # Drop an entry, e.g. after none of its addresses could be reached.
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+def open_socket(dns, host, port, connect_timeout, read_timeout):
+    # Connect to the first address for host that answers.
+    error = None
+    for family, sockaddr in dns.resolve(host, port):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(connect_timeout)
+        try:
+            with span("connect"):
+                sock.connect(sockaddr)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        sock.settimeout(read_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    dns.forget(host, port)
+    raise error or OSError("no addresses for {}".format(host))
+
+class CachedDnsHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, dns, connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT):
+        super().__init__(host, port, timeout=read_timeout)
+        self.dns = dns
+        self.connect_timeout = connect_timeout
+
+    def connect(self):
+        self.sock = open_socket(self.dns, self.host, self.port,
+                self.connect_timeout, self.timeout)
+
+class CachedDnsHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, port, dns, connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT):
+        super().__init__(host, port, timeout=read_timeout)
+        self.dns = dns
+        self.connect_timeout = connect_timeout
+
+    def connect(self):
+        sock = open_socket(self.dns, self.host, self.port,
+                self.connect_timeout, self.timeout)
+        with span("tls"):
+            self.sock = self._context.wrap_socket(sock,
+                    server_hostname=self.host)
+
+CONNECTION_CLASSES = {"http": CachedDnsHTTPConnection,
+        "https": CachedDnsHTTPSConnection}
+
+class Session:
+    """
+    Pool of persistent HTTP/1.1 connections with a DNS cache.
+    connect_timeout = seconds to connect.
+    read_timeout = seconds each read may wait for data.
+    """
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT, dns_ttl=DNS_TTL,
+            idle_timeout=IDLE_TIMEOUT):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.dns = DnsCache(dns_ttl)
+        # (scheme, host, port) : [(connection, time last used), ...]
+        self.idle = {}
+        self.lock = threading.Lock()
+        # Number of new connections made, e.g. to check re-use.
+        self.connections_opened = 0
+
+    def _take(self, key):
+        # An idle connection for key, or None.
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                connection, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection
+                connection.close()
+        return None
+
+    def _give_back(self, key, connection):
+        with self.lock:
+            self.idle.setdefault(key, []).append(
+                    (connection, time.monotonic()))
+
+    def _new(self, key):
+        scheme, host, port = key
+        self.connections_opened += 1
+        return CONNECTION_CLASSES[scheme](host, port, self.dns,
+                self.connect_timeout, self.read_timeout)
+
+    def _send(self, key, path, headers):
+        # Send a GET, re-trying once on a new connection if a kept
+        # connection turns out to be stale.
+        connection = self._take(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._new(key)
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError, http.client.BadStatusLine) as e:
+                connection.close()
+                if not reused:
+                    raise urllib.error.URLError(e)
+                reused = False
+                connection = None
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise urllib.error.URLError(e)
+
+    @contextlib.contextmanager
+    def get(self, url, headers=None):
+        """
+        GET url. Use as a context manager giving the http.client.HTTPResponse.
+        The connection is kept for re-use if the response was read to the end.
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in CONNECTION_CLASSES:
+            raise urllib.error.URLError("unknown url type: " + url)
+        key = (parts.scheme, parts.hostname,
+                parts.port or DEFAULT_PORTS[parts.scheme])
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers or {})
+        headers.setdefault("Host", parts.netloc)
+
+        connection, response = self._send(key, path, headers)
+        try:
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status,
+                        response.reason, response.headers, response)
+            yield response
+        finally:
+            if response.isclosed() and not response.will_close:
+                self._give_back(key, connection)
+            else:
+                connection.close()
+
+    def close(self):
+        # Close all idle connections.
+        with self.lock:
+            for idle in self.idle.values():
+                for connection, last_used in idle:
+                    connection.close()
+            self.idle = {}
+
+_session = None
+
+def get_session():
+    # Shared session for this process, created on first use.
+    global _session
+    if _session is None:
+        _session = Session()
+    return _session
+
+if __name__ == "__main__":
+
+    # Time a few requests on one session. The first pays for DNS, TCP and TLS.
+    import sys
+    url = sys.argv[1] if len(sys.argv) > 1 else "https://translate.google.com/"
+    session = get_session()
+    for i in range(3):
+        start = time.monotonic()
+        with session.get(url, {"User-Agent": "Mozilla"}) as response:
+            response.read()
+        print("{:.3f} seconds, connections opened: {}".format(
+                time.monotonic() - start, session.connections_opened))
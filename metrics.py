@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#!
+# metrics.py
+#
+# Timings and counts for each stage of an announcement: the internet check,
+# building the url, DNS, connect, TLS, download, mpv start up and playback.
+#
+# Off unless the environment variable SAYTIME_METRICS is set, and then
+# span() and count() do nothing but return. SAYTIME_METRICS is either 1, to
+# collect for saytime_server.py's /metrics, or a file written at exit:
+# name.jsonl  one JSON object per line, for every span, counter and
+#             histogram. Appended to, so cron runs build up a trace.
+# other name  Prometheus text format, e.g. for node_exporter's textfile
+#             collector. Replaced on each write.
+#
+# Stage timings go into the histogram saytime_stage_seconds{stage}. A stage
+# that raises counts saytime_errors_total{stage, cause}, cause being the
+# exception class. Falling back to another way of speaking counts
+# saytime_fallbacks_total{stage, cause}.
+#
+# Example of use:
+# with span("download"):
+#     mp3_data = response.read()
+# count("saytime_fallbacks_total", stage="play", cause="PlayerError")
+#
+# $ SAYTIME_METRICS=/tmp/saytime.prom saytime.py; cat /tmp/saytime.prom
+#
+import os
+import time
+import atexit
+import bisect
+import threading
+from collections import deque
+
+METRICS = os.environ.get("SAYTIME_METRICS", "")
+# Histogram bucket upper bounds, seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+        2.5, 5.0, 10.0)
+# Most recent spans kept for the JSON lines trace.
+TRACE_SIZE = 10000
+STAGE_HISTOGRAM = "saytime_stage_seconds"
+ERRORS = "saytime_errors_total"
+FALLBACKS = "saytime_fallbacks_total"
+
+enabled = METRICS not in ("", "0")
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # Not cumulative. The last is for values above every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # [(upper bound, count of values <= bound), ...] ending with +Inf.
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class Registry:
+    """
+    Counters, histograms and recent spans for this process.
+    Metrics are keyed by (name, ((label, value), ...)).
+    """
+    def __init__(self, trace_size=TRACE_SIZE):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.trace = deque(maxlen=trace_size)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_span(self, stage, start, seconds, cause):
+        self.observe(STAGE_HISTOGRAM, seconds, stage=stage)
+        if cause is not None:
+            self.count(ERRORS, stage=stage, cause=cause)
+        with self.lock:
+            self.trace.append((start, stage, seconds, cause))
+
+    def to_prometheus(self):
+        # Prometheus text exposition format.
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(),
+                    key=lambda item: item[0])
+            lines = []
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append("# TYPE {} counter".format(name))
+                lines.append("{}{} {}".format(name, format_labels(labels),
+                        value))
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append("# TYPE {} histogram".format(name))
+                for bound, count in histogram.cumulative():
+                    lines.append("{}_bucket{} {}".format(name, format_labels(
+                            labels + (("le", format_bound(bound)),)), count))
+                lines.append("{}_sum{} {!r}".format(name,
+                        format_labels(labels), histogram.sum))
+                lines.append("{}_count{} {}".format(name,
+                        format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        # One JSON object per line: spans, then counters and histograms.
+        import json
+        pid = os.getpid()
+        with self.lock:
+            lines = [json.dumps({"span": stage, "time": start,
+                    "seconds": seconds, "error": cause, "pid": pid})
+                    for start, stage, seconds, cause in self.trace]
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(json.dumps({"counter": name,
+                        "labels": dict(labels), "value": value, "pid": pid}))
+            for (name, labels), histogram in sorted(self.histograms.items(),
+                    key=lambda item: item[0]):
+                lines.append(json.dumps({"histogram": name,
+                        "labels": dict(labels),
+                        "buckets": [[format_bound(bound), count] for
+                                bound, count in histogram.cumulative()],
+                        "sum": histogram.sum, "count": histogram.count,
+                        "pid": pid}))
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, path):
+        # Append JSON lines to a .jsonl file, otherwise replace the file
+        # with Prometheus text.
+        import tempfile
+        if path.endswith(".jsonl"):
+            with open(path, "a") as f:
+                f.write(self.to_json_lines())
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\",
+            "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in labels) + "}"
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+class Span:
+    # Times a with block as a stage. Exceptions are counted, not caught.
+    __slots__ = ("stage", "start", "wall")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        seconds = time.perf_counter() - self.start
+        get_registry().record_span(self.stage, self.wall, seconds,
+                None if kind is None else kind.__name__)
+        return False
+
+class _NullSpan:
+    # Used when metrics are off.
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+_null_span = _NullSpan()
+_registry = None
+
+def get_registry():
+    # Registry for this process, created on first use.
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+def span(stage):
+    # Context manager timing stage.
+    if not enabled:
+        return _null_span
+    return Span(stage)
+
+def count(name, amount=1, **labels):
+    # Add amount to the counter name with labels.
+    if enabled:
+        get_registry().count(name, amount, **labels)
+
+def observe(name, value, **labels):
+    # Add value to the histogram name with labels.
+    if enabled:
+        get_registry().observe(name, value, **labels)
+
+def enable(path=None):
+    """
+    Start collecting, e.g. in a long running process. If path is given
+    the metrics are written there at exit, as for SAYTIME_METRICS.
+    """
+    global enabled
+    enabled = True
+    if path:
+        atexit.register(write, path)
+
+def write(path=None):
+    # Write the metrics to path, by default SAYTIME_METRICS.
+    path = path or METRICS
+    if enabled and path and path != "1":
+        try:
+            get_registry().write(path)
+        except OSError:
+            pass
+
+if enabled and METRICS != "1":
+    atexit.register(write)
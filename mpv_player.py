@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+#!
+# mpv_player.py
+# Requires: mpv. $ apt install mpv
+#
+# Keep one mpv process alive and feed it clips over its JSON IPC socket,
+# instead of starting a new mpv for every message. mpv is started with
+# --idle so it waits for the next clip with the audio device open.
+#
+# Clips are appended to mpv's playlist, so several clips queue up and play
+# back to back. If mpv dies or stops answering it is restarted on the next
+# clip.
+#
+# Each clip is tracked by the playlist entry id in mpv's reply to loadfile,
+# and finished by the end-file event with that id. mpv sends end-file for a
+# stopped clip some time after the stop, so a clip queued in the meantime
+# is not mistaken for it.
+#
+# Example of use:
+# player = get_player()
+# player.play_file("/tmp/hello.mp3")
+# player.play_bytes(mp3_data)
+#
+import os
+import json
+import atexit
+import socket
+import tempfile
+import threading
+import subprocess
+try:
+    from pylib.metrics import span
+except ImportError:
+    from metrics import span
+
+MPV_ARGS = ("mpv", "--idle=yes", "--no-terminal", "--really-quiet",
+        "--no-video")
+# Seconds to wait for mpv to create its IPC socket and to answer a command.
+START_TIMEOUT = 5.0
+COMMAND_TIMEOUT = 2.0
+
+class PlayerError(Exception):
+    pass
+
+class MpvPlayer:
+    """
+    A long-lived mpv process controlled over JSON IPC.
+    args = mpv command line, without the --input-ipc-server option.
+    """
+    def __init__(self, args=MPV_ARGS):
+        self.args = args
+        self.process = None
+        self.sock = None
+        self.reader = None
+        self.socket_dir = None
+        self.clip_dir = None
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()
+        self.responses = {}
+        self.request_id = 0
+        # request_id: function(reply), called by the reader thread as the
+        # reply arrives, so it sees the events before and after in order.
+        self.on_reply = {}
+        # Clips mpv has queued and not finished, playlist entry id: temp
+        # file to remove when it ends, or None. Older mpv does not give ids,
+        # then the keys are made up, negative, and ended oldest first.
+        self.entries = {}
+        self.unknown_id = 0
+
+    @property
+    def pending(self):
+        # Number of clips loaded that mpv has not yet finished.
+        # play_file() returns once its entry is added.
+        return len(self.entries)
+
+    def start(self):
+        # Start mpv and connect to its IPC socket.
+        with span("mpv_start"):
+            self.close()
+            self.socket_dir = tempfile.mkdtemp(prefix="mpv-player-")
+            socket_path = os.path.join(self.socket_dir, "mpv.sock")
+            try:
+                self.process = subprocess.Popen(
+                        self.args + ("--input-ipc-server=" + socket_path,),
+                        stdin=subprocess.DEVNULL)
+            except OSError as e:
+                raise PlayerError("cannot start mpv: {}".format(e))
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with self.changed:
+                # Poll for the socket. mpv creates it shortly after starting.
+                waited = 0.0
+                while True:
+                    try:
+                        sock.connect(socket_path)
+                        break
+                    except OSError:
+                        if self.process.poll() is not None or \
+                                waited >= START_TIMEOUT:
+                            sock.close()
+                            self.close()
+                            raise PlayerError("mpv IPC socket not available")
+                        self.changed.wait(0.02)
+                        waited += 0.02
+                self.sock = sock
+                self.responses = {}
+
+            self.reader = threading.Thread(target=self._read_events,
+                    args=(sock,), daemon=True)
+            self.reader.start()
+
+    def _read_events(self, sock):
+        # Thread: read replies and events from mpv, one JSON object per line.
+        for line in sock.makefile("rb"):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            with self.changed:
+                if self.sock is not sock:
+                    # mpv was restarted. Its entry ids start again at 1.
+                    break
+                if "request_id" in message:
+                    callback = self.on_reply.pop(message["request_id"], None)
+                    if callback is not None:
+                        callback(message)
+                    self.responses[message["request_id"]] = message
+                elif message.get("event") == "end-file":
+                    self._end_entry(message.get("playlist_entry_id"),
+                            message.get("reason"))
+                self.changed.notify_all()
+        # mpv went away. A reader left over from before a restart must not
+        # touch the new mpv's clips.
+        with self.changed:
+            if self.sock is sock:
+                self.sock = None
+                self._end_all()
+                self.on_reply = {}
+            self.changed.notify_all()
+
+    def _end_entry(self, entry_id, reason):
+        # Called with self.changed held when mpv has finished an entry.
+        if entry_id not in self.entries:
+            # Without ids, clips end in order. A clip ended by stop() was
+            # dropped by stop() already.
+            unknown = [key for key in self.entries if key < 0]
+            if reason == "stop" or not unknown:
+                return
+            entry_id = max(unknown)
+        self._remove_temp_file(self.entries.pop(entry_id))
+
+    def _end_all(self):
+        # Called with self.changed held when every queued clip is gone.
+        for path in self.entries.values():
+            self._remove_temp_file(path)
+        self.entries = {}
+
+    def command(self, *args, on_reply=None):
+        """
+        Send a command and return mpv's reply data. Raises PlayerError.
+        on_reply = function(reply) for the reader thread to call with the
+        reply, with self.changed held.
+        """
+        with self.changed:
+            if self.sock is None:
+                raise PlayerError("mpv is not running")
+            self.request_id += 1
+            request_id = self.request_id
+            if on_reply is not None:
+                self.on_reply[request_id] = on_reply
+            line = json.dumps({"command": list(args),
+                    "request_id": request_id}) + "\n"
+            try:
+                self.sock.sendall(line.encode("utf-8"))
+            except OSError as e:
+                self.on_reply.pop(request_id, None)
+                raise PlayerError("mpv IPC write failed: {}".format(e))
+            if not self.changed.wait_for(
+                    lambda: request_id in self.responses or self.sock is None,
+                    COMMAND_TIMEOUT):
+                self.on_reply.pop(request_id, None)
+                raise PlayerError("mpv did not answer {}".format(args[0]))
+            reply = self.responses.pop(request_id, None)
+        if reply is None:
+            raise PlayerError("mpv exited")
+        if reply.get("error") != "success":
+            raise PlayerError("mpv {}: {}".format(args[0], reply.get("error")))
+        return reply.get("data")
+
+    def is_alive(self):
+        # Health check: process running and answering on the socket.
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.command("get_property", "pid")
+        except PlayerError:
+            return False
+        return True
+
+    def ensure_running(self):
+        # Start or restart mpv if it is not healthy.
+        if not self.is_alive():
+            self.start()
+
+    def play_file(self, path, wait=True, temp_file=None):
+        """
+        Queue a file for playback after any clips already queued.
+        wait = block until everything queued has been played.
+        temp_file = file to remove once this clip has finished.
+        """
+        def loaded(reply):
+            if reply.get("error") != "success":
+                return
+            data = reply.get("data")
+            entry_id = data.get("playlist_entry_id") if isinstance(data,
+                    dict) else None
+            if entry_id is None:
+                self.unknown_id -= 1
+                entry_id = self.unknown_id
+            self.entries[entry_id] = temp_file
+
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    if attempt == 2 or self.sock is None:
+                        self.ensure_running()
+                    self.command("loadfile", path, "append-play",
+                            on_reply=loaded)
+                    break
+                except PlayerError:
+                    if attempt == 2:
+                        raise
+        if wait:
+            self.wait()
+
+    def play_bytes(self, data, wait=True, suffix=".mp3"):
+        # Queue in-memory audio for playback via a temporary file.
+        with self.changed:
+            if self.clip_dir is None:
+                self.clip_dir = tempfile.mkdtemp(prefix="mpv-clips-")
+        fd, path = tempfile.mkstemp(dir=self.clip_dir, suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            self.play_file(path, wait=False, temp_file=path)
+        except PlayerError:
+            self._remove_temp_file(path)
+            raise
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        # Wait until all queued clips have finished. Returns False on timeout.
+        with self.changed:
+            return self.changed.wait_for(lambda: self.pending == 0, timeout)
+
+    def stop(self):
+        """
+        Stop the current clip and clear the queue. Only the clips queued
+        before mpv handles the stop are forgotten; the end-file mpv sends
+        later for the stopped clip no longer matches any entry.
+        """
+        def stopped(reply):
+            if reply.get("error") == "success":
+                self._end_all()
+
+        try:
+            self.command("stop", on_reply=stopped)
+        except PlayerError:
+            pass
+
+    def _remove_temp_file(self, path):
+        if path is not None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def close(self):
+        # Quit mpv and remove its IPC socket.
+        if self.sock is not None:
+            try:
+                self.command("quit")
+            except PlayerError:
+                pass
+        with self.changed:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            self._end_all()
+            self.on_reply = {}
+            self.changed.notify_all()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=COMMAND_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.socket_dir is not None:
+            try:
+                os.unlink(os.path.join(self.socket_dir, "mpv.sock"))
+            except OSError:
+                pass
+            try:
+                os.rmdir(self.socket_dir)
+            except OSError:
+                pass
+            self.socket_dir = None
+
+    def shutdown(self):
+        # Quit mpv and remove any clips still waiting to be played.
+        self.close()
+        with self.changed:
+            if self.clip_dir is not None:
+                try:
+                    os.rmdir(self.clip_dir)
+                except OSError:
+                    pass
+                self.clip_dir = None
+
+_player = None
+
+def get_player():
+    # Shared player for this process, started on first use.
+    global _player
+    if _player is None:
+        _player = MpvPlayer()
+        atexit.register(_player.shutdown)
+    return _player
+
+if __name__ == "__main__":
+
+    import sys
+    player = get_player()
+    for path in sys.argv[1:]:
+        player.play_file(path, wait=False)
+    player.wait()
+    player.shutdown()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#!
+# pcm_store.py
+# Requires: ffmpeg or mpv to decode, pacat (pulseaudio-utils) or aplay
+# (alsa-utils) to play.
+#
+# Decode each clip once to raw PCM at a fixed format, signed 16 bit
+# little-endian mono at 24000 Hz, and keep it on disk next to the mp3
+# cache. Playback writes the samples to one long-lived pacat or aplay
+# process, so no decoder has to start before the first sample is heard.
+# Clips wait their turn in the speech queue (speech_queue.py) like any other
+# speech, and stopping one restarts the sink to drop what it has buffered.
+#
+# A clip that has not been decoded yet is spoken by gspeak() through mpv,
+# and decoded in the background for next time.
+#
+# Example of use:
+# play_clip("The time is exactly three o'clock in the afternoon.")
+#
+# $ pcm_store.py --days 7      # decode every cached saytime clip
+#
+import os
+import time
+import shutil
+import threading
+import subprocess
+try:
+    from pylib.audio_cache import AudioCache, CACHE_DIR, get_cache
+    from pylib.gspeak import gspeak
+    from pylib.voice_pack import lookup
+    from pylib.speech_queue import say_pcm, NORMAL
+except ImportError:
+    from audio_cache import AudioCache, CACHE_DIR, get_cache
+    from gspeak import gspeak
+    from voice_pack import lookup
+    from speech_queue import say_pcm, NORMAL
+
+RATE = 24000
+CHANNELS = 1
+BYTES_PER_SECOND = RATE * CHANNELS * 2
+PCM_DIR = os.path.join(CACHE_DIR, "pcm")
+MAX_BYTES = 256 * 1024 * 1024
+
+DECODERS = (
+    ("ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le",
+        "-ac", str(CHANNELS), "-ar", str(RATE), "pipe:1"),
+    ("mpv", "--no-config", "--really-quiet", "--no-video", "--ao=pcm",
+        "--ao-pcm-file=/dev/stdout", "--ao-pcm-waveheader=no",
+        "--audio-format=s16", "--audio-samplerate=" + str(RATE),
+        "--audio-channels=" + ("mono" if CHANNELS == 1 else "stereo"), "-"),
+)
+SINKS = (
+    ("pacat", "--playback", "--raw", "--format=s16le",
+        "--rate=" + str(RATE), "--channels=" + str(CHANNELS),
+        "--latency-msec=20"),
+    ("aplay", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(RATE),
+        "-c", str(CHANNELS), "-B", "20000"),
+)
+# Seconds of audio buffered in the sink after the last write.
+SINK_LATENCY = 0.02
+
+class DecodeError(Exception):
+    pass
+
+def decode(audio_data):
+    # Decode mp3 (or anything the decoder reads) to raw PCM at RATE.
+    for args in DECODERS:
+        if shutil.which(args[0]) is None:
+            continue
+        result = subprocess.run(args, input=audio_data,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode == 0 and result.stdout:
+            return result.stdout
+    raise DecodeError("no decoder could decode the audio")
+
+class PcmSink:
+    """
+    A long-lived pacat or aplay fed raw PCM on its stdin. Restarted if it
+    exits.
+    """
+    def __init__(self, sinks=SINKS):
+        self.sinks = sinks
+        self.process = None
+        self.lock = threading.Lock()
+        # Notified by stop(), to end wait() early.
+        self.stopped = threading.Condition()
+        # Calls of stop(), so write() can tell its sink was killed.
+        self.stops = 0
+        # time.monotonic() when the samples written so far will have played.
+        self.busy_until = 0.0
+
+    def start(self):
+        if self.process is not None:
+            # Exited, killed by stop(), or not reading.
+            self.process.kill()
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.process.wait()
+            self.process = None
+        for args in self.sinks:
+            if shutil.which(args[0]) is None:
+                continue
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL)
+            return
+        raise OSError("no PCM sink: install pacat or aplay")
+
+    def write(self, pcm_data, wait=True):
+        """
+        Queue samples after anything already written.
+        wait = block until they have been played.
+        """
+        with self.lock:
+            stops = self.stops
+            for attempt in (1, 2):
+                if (attempt == 2 or self.process is None or
+                        self.process.poll() is not None):
+                    self.start()
+                try:
+                    self.process.stdin.write(pcm_data)
+                    self.process.stdin.flush()
+                    break
+                except BrokenPipeError:
+                    if self.stops != stops:
+                        # Killed by stop() while writing.
+                        return
+                    if attempt == 2:
+                        raise
+            with self.stopped:
+                if self.stops != stops:
+                    return
+                now = time.monotonic()
+                self.busy_until = (max(now, self.busy_until) +
+                        len(pcm_data) / BYTES_PER_SECOND)
+        if wait:
+            self.wait()
+
+    def wait(self):
+        # Sleep until everything written has been played, or stop().
+        with self.stopped:
+            while True:
+                delay = self.busy_until + SINK_LATENCY - time.monotonic()
+                if delay <= 0:
+                    return
+                self.stopped.wait(delay)
+
+    def stop(self):
+        # Drop the samples not yet played, from any thread. The sink is
+        # started again by the next write().
+        with self.stopped:
+            self.stops += 1
+            process = self.process
+            self.busy_until = 0.0
+            self.stopped.notify_all()
+        if process is not None:
+            process.kill()
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process = None
+
+_store = None
+_sink = None
+
+def get_store():
+    # PCM clips, kept like the mp3 cache but in PCM_DIR.
+    global _store
+    if _store is None:
+        _store = AudioCache(PCM_DIR, MAX_BYTES, suffix=".pcm")
+    return _store
+
+def get_sink():
+    global _sink
+    if _sink is None:
+        _sink = PcmSink()
+    return _sink
+
+def prepare(message, language="en"):
+    """
+    Decode the cached mp3 for message into the PCM store.
+    Returns the PCM data, or None if there is no cached mp3 to decode.
+    """
+    mp3_data = lookup(message, language)
+    if mp3_data is None:
+        mp3_data = get_cache().get(message, language)
+    if mp3_data is None:
+        return None
+    pcm_data = decode(mp3_data)
+    get_store().put(message, language, pcm_data)
+    return pcm_data
+
+def play_clip(message, language="en", wait=True, priority=NORMAL,
+        max_delay=None):
+    """
+    Play the PCM clip for message. If it has not been decoded, speak it with
+    gspeak() through mpv, and decode it in the background for next time.
+    priority, max_delay = as for the speech queue.
+    Returns True if the PCM clip was played (or queued, or dropped as out of
+    date).
+    """
+    pcm_data = lookup(message, language, "pcm")
+    if pcm_data is None:
+        pcm_data = get_store().get(message, language)
+    if pcm_data is not None:
+        try:
+            say_pcm(pcm_data, priority, max_delay, wait)
+            return True
+        except OSError:
+            pass
+    gspeak(message, language, priority=priority, max_delay=max_delay)
+    if pcm_data is None:
+        threading.Thread(target=_prepare_quietly, args=(message, language),
+                daemon=True).start()
+    return False
+
+def _prepare_quietly(message, language):
+    try:
+        prepare(message, language)
+    except (DecodeError, OSError):
+        pass
+
+if __name__ == "__main__":
+
+    import argparse
+    try:
+        from pylib.prewarm_cache import list_clips
+    except ImportError:
+        from prewarm_cache import list_clips
+
+    parser = argparse.ArgumentParser(
+            description="Decode cached saytime clips to PCM.")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--language", default="en")
+    args = parser.parse_args()
+
+    decoded = missing = 0
+    store = get_store()
+    for clip in list_clips(args.days):
+        if (clip, args.language) in store:
+            continue
+        if prepare(clip, args.language) is None:
+            missing += 1
+        else:
+            decoded += 1
+    print("{} decoded, {} not in the mp3 cache".format(decoded, missing))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#!
+# prewarm_cache.py
+#
+# Fill the gspeak audio cache with every clip saytime.py can speak:
+# the terse and verbose phrase for all 1440 minutes of the day, and the
+# date prefix for today and the next N days.
+#
+# Clips are fetched by a bounded pool of threads, with a shared rate limit
+# so google is not hammered. Clips already in the cache are skipped, so an
+# interrupted run simply resumes where it stopped when started again.
+#
+# Fetches go through a circuit breaker of their own, separate from the one
+# announcements use. When a burst of errors, e.g. 429 Too Many Requests,
+# opens it, the workers wait for it to close and carry on. Only once it has
+# stayed open for MAX_WAIT seconds are the remaining clips given up on.
+#
+# Usage:
+# $ prewarm_cache.py                   # en, 7 days, 8 threads, 5 per second
+# $ prewarm_cache.py --days 30 --language en-au --workers 4 --rate 2
+#
+import sys
+import time
+import argparse
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    from pylib.gspeak import build_url, HEADERS
+    from pylib.audio_cache import get_cache
+    from pylib.saytime_phrase import terse_table, verbose_table, get_date_clip
+except ImportError:
+    from gspeak import build_url, HEADERS
+    from audio_cache import get_cache
+    from saytime_phrase import terse_table, verbose_table, get_date_clip
+
+# Fetches of a clip that may fail, each after the fetcher's own retries.
+ATTEMPTS = 3
+# Seconds the circuit breaker stays open after a burst of failures.
+COOL_DOWN = 5.0
+# Seconds a clip waits for the circuit breaker to close before giving up.
+MAX_WAIT = 120.0
+
+def list_clips(days=7, start=None):
+    """
+    Every clip saytime.py can speak, in a stable order, without duplicates.
+    days = number of days after start to include date prefixes for.
+    start = datetime.date of the first date prefix, default today.
+    """
+    if start is None:
+        start = date.today()
+    clips = [get_date_clip(start + timedelta(days=n)) for n in range(days + 1)]
+    clips.extend(terse_table)
+    clips.extend(verbose_table)
+    return list(dict.fromkeys(clips))
+
+class RateLimiter:
+    """
+    Token bucket shared between threads.
+    rate = requests per second, burst = requests allowed back to back.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # Block until a request may be made.
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                        self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def make_fetcher():
+    # A Fetcher with its own circuit breaker, so a bulk run neither trips
+    # nor waits on the one announcements use.
+    try:
+        from pylib.resilient_fetch import Fetcher, CircuitBreaker
+    except ImportError:
+        from resilient_fetch import Fetcher, CircuitBreaker
+    return Fetcher(breaker=CircuitBreaker(cool_down=COOL_DOWN))
+
+def fetch_clip(clip, language, cache, limiter, fetcher, outage,
+        max_wait=MAX_WAIT):
+    """
+    Fetch one clip and store it in the cache. While the circuit breaker is
+    open wait for it, up to max_wait seconds. outage = threading.Event set
+    once a clip has waited that long, after which no clip waits.
+    """
+    try:
+        from pylib.resilient_fetch import CircuitOpen, is_final
+    except ImportError:
+        from resilient_fetch import CircuitOpen, is_final
+    url = build_url(clip, language)
+    failures = 0
+    waited = 0.0
+    while True:
+        limiter.wait()
+        try:
+            mp3_data = fetcher.fetch(url, HEADERS)
+            break
+        except CircuitOpen:
+            if outage.is_set() or waited >= max_wait:
+                outage.set()
+                raise
+            delay = max(fetcher.breaker.retry_after(), 0.1)
+            time.sleep(delay)
+            waited += delay
+        except Exception as e:
+            failures += 1
+            if is_final(e) or failures >= ATTEMPTS:
+                raise
+    cache.put(clip, language, mp3_data)
+
+def prewarm(clips, language="en", workers=8, rate=5.0, report=None,
+        fetcher=None):
+    """
+    Fetch every clip not already in the cache.
+    report = function called with (done, total, fetched, failed) after each
+             clip, or None.
+    fetcher = resilient_fetch.Fetcher, by default one made for this run.
+    Returns (fetched, skipped, failed)
+    """
+    cache = get_cache()
+    todo = [clip for clip in clips if (clip, language) not in cache]
+    skipped = len(clips) - len(todo)
+    limiter = RateLimiter(rate, burst=workers)
+    fetcher = fetcher or make_fetcher()
+    outage = threading.Event()
+    fetched = failed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_clip, clip, language, cache, limiter,
+                fetcher, outage) for clip in todo]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                if future.exception() is None:
+                    fetched += 1
+                else:
+                    failed += 1
+                if report:
+                    report(done, len(todo), fetched, failed)
+        except KeyboardInterrupt:
+            # Completed clips are already in the cache. Re-run to resume.
+            for future in futures:
+                future.cancel()
+            raise
+
+    return fetched, skipped, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Fill the gspeak audio cache with saytime phrases.")
+    parser.add_argument("--days", type=int, default=7,
+            help="date prefixes for today and the next DAYS days (7)")
+    parser.add_argument("--language", default="en",
+            help="google translate language code (en)")
+    parser.add_argument("--workers", type=int, default=8,
+            help="number of concurrent fetches (8)")
+    parser.add_argument("--rate", type=float, default=5.0,
+            help="maximum fetches per second (5)")
+    args = parser.parse_args(argv)
+
+    clips = list_clips(args.days)
+    start = time.monotonic()
+
+    def report(done, total, fetched, failed):
+        if done % 50 and done != total:
+            return
+        elapsed = time.monotonic() - start
+        sys.stderr.write("{}/{} fetched {} failed {} ({:.1f}/s)\n".format(
+                done, total, fetched, failed, done / max(elapsed, 1e-6)))
+
+    try:
+        fetched, skipped, failed = prewarm(clips, args.language,
+                args.workers, args.rate, report)
+    except KeyboardInterrupt:
+        sys.stderr.write("Interrupted. Run again to resume.\n")
+        return 130
+
+    print("{} clips: {} fetched, {} already cached, {} failed".format(
+            len(clips), fetched, skipped, failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#!
+# resilient_fetch.py
+#
+# GET with bounded retries, hedging and a circuit breaker, for gspeak.
+#
+# A request that fails is tried again up to RETRIES times, after a random
+# wait of up to BACKOFF, 2 * BACKOFF, ... seconds, so many clients that
+# failed together do not all retry together.
+#
+# A request with no answer by the p95 of recent response times is hedged:
+# the same request is sent again on another connection, and whichever
+# answers first is used. This cuts the slow tail at the cost of about 5%
+# more requests.
+#
+# After FAILURES fetches in a row have failed, the circuit opens: fetches
+# fail at once with CircuitOpen, a URLError, so the caller goes straight to
+# its offline path (espeak) instead of waiting for timeouts. After
+# COOL_DOWN seconds one fetch is let through to test the network. If it
+# works the circuit closes, otherwise it stays open for another COOL_DOWN.
+#
+# stream() reads a body as it arrives, e.g. to play it while downloading.
+# It goes through the circuit breaker but is neither retried nor hedged.
+#
+# Example of use:
+# mp3_data = get_fetcher().fetch(url, {"User-Agent": "Mozilla"})
+# with get_fetcher().stream(url, headers) as read:
+#     chunk = read(4096)
+#
+import time
+import random
+import threading
+import contextlib
+import http.client
+import urllib.error
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    from pylib.http_session import get_session
+    from pylib.metrics import count
+except ImportError:
+    from http_session import get_session
+    from metrics import count
+
+RETRIES = 2
+# Seconds. The nth retry waits a random time up to BACKOFF * 2 ** (n - 1).
+BACKOFF = 0.1
+# Response times kept to work out the p95, and how many are needed first.
+LATENCY_WINDOW = 100
+MIN_SAMPLES = 10
+# Never hedge sooner than this many seconds.
+MIN_HEDGE_DELAY = 0.05
+# Failed fetches in a row that open the circuit, and seconds it stays open.
+FAILURES = 3
+COOL_DOWN = 30.0
+FETCH_WORKERS = 8
+
+class CircuitOpen(urllib.error.URLError):
+    pass
+
+def is_final(error):
+    # True for an HTTPError that retrying will not change: the server is up
+    # and answered 4xx, other than 429 Too Many Requests.
+    return (isinstance(error, urllib.error.HTTPError) and error.code < 500
+            and error.code != 429)
+
+class CircuitBreaker:
+    """
+    Counts failures in a row. Open after failures of them, for cool_down
+    seconds, then lets one trial call through.
+    """
+    def __init__(self, failures=FAILURES, cool_down=COOL_DOWN):
+        self.failures = failures
+        self.cool_down = cool_down
+        self.lock = threading.Lock()
+        self.failed = 0
+        # time.monotonic() until which the circuit is open, or None.
+        self.open_until = None
+        self.trial = False
+
+    def check(self):
+        # Raise CircuitOpen unless a call may be made now.
+        with self.lock:
+            if self.open_until is None:
+                return
+            if time.monotonic() < self.open_until or self.trial:
+                raise CircuitOpen("circuit open after {} failures".format(
+                        self.failed))
+            # Half open. Only this call goes through until it is done.
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failed = 0
+            self.open_until = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failed += 1
+            if self.trial or self.failed >= self.failures:
+                if self.open_until is None:
+                    count("saytime_circuit_opened_total")
+                self.open_until = time.monotonic() + self.cool_down
+            self.trial = False
+
+    def release(self):
+        # End a trial call that neither worked nor failed, e.g. its caller
+        # raised. The next call after the cool down is a new trial.
+        with self.lock:
+            self.trial = False
+
+    def retry_after(self):
+        # Seconds until a trial call may be made. 0 if the circuit is closed
+        # or the cool down is over.
+        with self.lock:
+            if self.open_until is None:
+                return 0.0
+            return max(0.0, self.open_until - time.monotonic())
+
+    def is_open(self):
+        with self.lock:
+            return (self.open_until is not None and
+                    time.monotonic() < self.open_until)
+
+class LatencyTracker:
+    # Recent response times, for the hedge delay.
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        # Nearest-rank percentile, or None without MIN_SAMPLES samples.
+        with self.lock:
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+class Fetcher:
+    """
+    GET bodies with retries, hedging and a circuit breaker.
+    session = http_session.Session
+    hedge = send a second request after the p95, if the first is slow.
+    """
+    def __init__(self, session=None, retries=RETRIES, backoff=BACKOFF,
+            hedge=True, breaker=None):
+        self.session = session or get_session()
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+    def get(self, url, headers):
+        # One request. Errors are raised as URLError.
+        start = time.monotonic()
+        try:
+            with self.session.get(url, headers) as response:
+                data = response.read()
+        except urllib.error.URLError:
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            # Timeouts and resets while reading the body.
+            raise urllib.error.URLError(e)
+        self.latency.add(time.monotonic() - start)
+        return data
+
+    def hedge_delay(self):
+        # Seconds to wait for the first request before sending a second.
+        if not self.hedge:
+            return None
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(MIN_HEDGE_DELAY, p95)
+
+    def get_hedged(self, url, headers):
+        # get(), sending the request again if it is slower than the p95.
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.get(url, headers)
+        pending = {self.executor.submit(self.get, url, headers)}
+        done, not_done = wait(pending, timeout=delay)
+        if not done:
+            count("saytime_hedged_requests_total")
+            pending.add(self.executor.submit(self.get, url, headers))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # A slower duplicate finishes in the background and
+                    # leaves its connection for re-use.
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def fetch(self, url, headers=None):
+        """
+        Body of url. Raises CircuitOpen at once while the circuit is open,
+        HTTPError for a 4xx answer, otherwise URLError once the retries
+        have failed.
+        """
+        self.breaker.check()
+        try:
+            error = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    count("saytime_retries_total")
+                    time.sleep(random.uniform(0, self.backoff *
+                            2 ** (attempt - 1)))
+                try:
+                    data = self.get_hedged(url, headers)
+                except urllib.error.URLError as e:
+                    if is_final(e):
+                        self.breaker.record_success()
+                        raise
+                    error = e
+                else:
+                    self.breaker.record_success()
+                    return data
+            self.breaker.record_failure()
+            raise error
+        except BaseException:
+            # Anything but a network error, e.g. KeyboardInterrupt. Does
+            # nothing if the breaker was already told.
+            self.breaker.release()
+            raise
+
+    @contextlib.contextmanager
+    def stream(self, url, headers=None):
+        """
+        Context manager that yields read(size), which returns the next part
+        of the body of url as it arrives, b"" at the end. Raises as fetch()
+        does, but the request is neither retried nor hedged, as the caller
+        may have used part of the body. Errors raised by the with block
+        itself, e.g. from a player, leave the circuit breaker as it was.
+        """
+        self.breaker.check()
+        outcome = self.breaker.release
+        opened = False
+
+        def read(size):
+            nonlocal outcome
+            try:
+                data = response.read1(size)
+                if not data and response.length:
+                    # Closed before Content-Length bytes were sent.
+                    raise http.client.IncompleteRead(b"", response.length)
+                return data
+            except (OSError, http.client.HTTPException) as e:
+                outcome = self.breaker.record_failure
+                raise urllib.error.URLError(e)
+
+        try:
+            with self.session.get(url, headers) as response:
+                opened = True
+                yield read
+            if outcome is self.breaker.release:
+                outcome = self.breaker.record_success
+        except urllib.error.URLError as e:
+            if not opened:
+                outcome = (self.breaker.record_success if is_final(e) else
+                        self.breaker.record_failure)
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            if opened:
+                raise
+            outcome = self.breaker.record_failure
+            raise urllib.error.URLError(e)
+        finally:
+            outcome()
+
+_fetcher = None
+
+def get_fetcher():
+    # Shared fetcher for this process, created on first use.
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher()
+    return _fetcher
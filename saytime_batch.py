@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#!
+# saytime_batch.py
+# Optional: numpy. $ apt install python3-numpy
+#
+# Time phrases for many timestamps at once, e.g. to annotate a log export.
+#
+# With numpy the work is done on whole arrays: the UTC offset is looked up
+# once per day (and once per 15 minutes on days the clocks change), the
+# minute of the day and the date are worked out with integer arithmetic,
+# and the phrases are gathered by index from the tables in
+# saytime_phrase.py. Without numpy the same is done one timestamp at a time,
+# with the offsets and date prefixes memoized.
+#
+# Timestamps may be epoch seconds (int or float), datetime objects (naive
+# ones are local time, as for datetime.timestamp()) or numpy datetime64
+# values (UTC). Phrases are for the local time zone.
+#
+# Example of use:
+# phrases(numpy.array([1550113200, 1550113500]))   # numpy array of phrases
+# phrases([datetime.now()], verbose=True)          # list of phrases
+# for batch in stream_phrases(open("epochs.txt")): ...
+#
+# $ cut -d' ' -f1 access.log | saytime_batch.py --verbose
+#
+import sys
+import math
+import time
+import argparse
+import itertools
+from datetime import date, datetime
+try:
+    from pylib.saytime_phrase import (terse_table, verbose_table,
+            build_day_month_year, MINUTES_PER_DAY)
+except ImportError:
+    from saytime_phrase import (terse_table, verbose_table,
+            build_day_month_year, MINUTES_PER_DAY)
+
+try:
+    import numpy as np
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+DAY = 24 * 60 * 60
+# Clocks change on a 15 minute boundary in every time zone.
+BUCKET = 15 * 60
+# Timestamps converted at a time by stream_phrases().
+BATCH_SIZE = 1 << 16
+# date.toordinal() of 1970-01-01
+UNIX_ORDINAL = date(1970, 1, 1).toordinal()
+
+def get_offset(seconds):
+    # Local UTC offset, in seconds, at epoch seconds.
+    return time.localtime(seconds).tm_gmtoff
+
+def get_day_prefix(day_number):
+    # Date prefix for a day number, i.e. local days since 1970-01-01.
+    return build_day_month_year(date.fromordinal(UNIX_ORDINAL + day_number))
+
+def to_seconds(value):
+    # Whole epoch seconds for a number or a datetime.
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return math.floor(float(value))
+
+def phrases_python(times, verbose=False):
+    # Phrases for an iterable of timestamps, one at a time.
+    table = verbose_table if verbose else terse_table
+    offsets = {}
+    prefixes = {}
+    result = []
+    for value in times:
+        seconds = to_seconds(value)
+        bucket = seconds // BUCKET
+        offset = offsets.get(bucket)
+        if offset is None:
+            offset = offsets[bucket] = get_offset(bucket * BUCKET)
+        local = seconds + offset
+        phrase = table[local // 60 % MINUTES_PER_DAY]
+        if verbose:
+            day = local // DAY
+            prefix = prefixes.get(day)
+            if prefix is None:
+                prefix = prefixes[day] = get_day_prefix(day)
+            phrase = prefix + phrase
+        result.append(phrase)
+    return result
+
+# numpy versions of the phrase tables, made on first use.
+_arrays = {}
+
+def get_array(name):
+    if name not in _arrays:
+        table = terse_table if name == "terse" else verbose_table
+        array = np.empty(len(table), dtype=object)
+        array[:] = table
+        _arrays[name] = array
+    return _arrays[name]
+
+def gather_by_day(days, function, dtype=object):
+    """
+    function(day) for every element of an array of day numbers, calling
+    function once per day. A table covering every day from the first to the
+    last is used when it is no longer than the array, otherwise only the
+    days that occur are looked up.
+    """
+    first = int(days.min())
+    span = int(days.max()) - first + 1
+    if span <= days.size:
+        values = np.array([function(first + day) for day in range(span)],
+                dtype=dtype)
+        return values[days - first]
+    unique, inverse = np.unique(days, return_inverse=True)
+    values = np.array([function(int(day)) for day in unique], dtype=dtype)
+    return values[inverse.reshape(days.shape)]
+
+def to_seconds_array(times):
+    # int64 numpy array of epoch seconds.
+    times = np.asarray(times)
+    if times.dtype.kind == "M":
+        return times.astype("datetime64[s]").astype(np.int64)
+    if times.dtype.kind == "f":
+        return np.floor(times).astype(np.int64)
+    if times.dtype.kind in "iu":
+        return times.astype(np.int64)
+    return np.fromiter((to_seconds(value) for value in times.ravel()),
+            dtype=np.int64, count=times.size).reshape(times.shape)
+
+def local_indices(times):
+    """
+    (minute of the day, local day number) arrays for timestamps, using
+    numpy. minute of the day indexes terse_table and verbose_table.
+    """
+    seconds = to_seconds_array(times)
+    if seconds.size == 0:
+        return seconds, seconds
+    # Offsets at the start and end of each UTC day. Where they differ the
+    # clocks changed that day, and the offset is found per 15 minutes.
+    days = seconds // DAY
+    offsets = gather_by_day(days, lambda day: get_offset(day * DAY),
+            np.int64)
+    after = gather_by_day(days, lambda day: get_offset((day + 1) * DAY),
+            np.int64)
+    changed = offsets != after
+    if changed.any():
+        offsets[changed] = gather_by_day(seconds[changed] // BUCKET,
+                lambda bucket: get_offset(bucket * BUCKET), np.int64)
+    local = seconds + offsets
+    return local // 60 % MINUTES_PER_DAY, local // DAY
+
+def phrases_numpy(times, verbose=False):
+    # Phrases for timestamps as a numpy array of str objects.
+    minutes, days = local_indices(times)
+    if not verbose:
+        return get_array("terse")[minutes]
+    if minutes.size == 0:
+        return np.empty(minutes.shape, dtype=object)
+    return gather_by_day(days, get_day_prefix) + get_array("verbose")[minutes]
+
+def phrases(times, verbose=False):
+    """
+    Time phrases for timestamps.
+    times = numpy array, or any iterable of epoch seconds or datetimes.
+    verbose = include the date prefix.
+    Returns a numpy array if given one, otherwise a list.
+    """
+    if not numpy_available:
+        return phrases_python(times, verbose)
+    if isinstance(times, np.ndarray):
+        return phrases_numpy(times, verbose)
+    return phrases_numpy(list(times), verbose).tolist()
+
+def stream_phrases(times, verbose=False, batch_size=BATCH_SIZE):
+    """
+    Phrases for timestamps that need not fit in memory, e.g. lines of a
+    file. Yields the phrases for each batch_size timestamps, as phrases()
+    returns them.
+    """
+    if numpy_available and isinstance(times, np.ndarray):
+        for start in range(0, len(times), batch_size):
+            yield phrases_numpy(times[start:start + batch_size], verbose)
+        return
+    iterator = iter(times)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield phrases(batch, verbose)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Print the time phrase for each epoch time on stdin.")
+    parser.add_argument("--verbose", action="store_true",
+            help="include the date")
+    args = parser.parse_args(argv)
+    lines = (line for line in sys.stdin if line.strip())
+    try:
+        for batch in stream_phrases(lines, args.verbose):
+            sys.stdout.write("\n".join(batch) + "\n")
+    except ValueError as e:
+        print("saytime_batch error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#!
+# saytime_loadgen.py
+#
+# Load generator for saytime_server.py. Opens a number of keep-alive
+# connections and sends requests on each, one after the other, for a fixed
+# time. Reports requests per second and the latency percentiles.
+#
+# $ saytime_server.py --no-prerender &
+# $ saytime_loadgen.py --connections 1000 --seconds 10
+# $ saytime_loadgen.py --path "/audio?time=15:00"
+#
+import sys
+import time
+import asyncio
+import argparse
+try:
+    from pylib.saytime_server import PORT
+except ImportError:
+    from saytime_server import PORT
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+async def client(host, port, path, end, latencies, errors):
+    # One keep-alive connection, sending requests until end.
+    request = ("GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(path, host)
+            ).encode("ascii")
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append("connect")
+        return
+    try:
+        while time.monotonic() < end:
+            start = time.monotonic()
+            writer.write(request)
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                if header.lower().startswith(b"content-length:"):
+                    length = int(header.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.monotonic() - start)
+            if not status.startswith(b"HTTP/1.1 200"):
+                errors.append(status.decode("latin-1").strip())
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        errors.append("connection lost")
+    finally:
+        writer.close()
+
+async def run(host, port, path, connections, seconds):
+    latencies = []
+    errors = []
+    start = time.monotonic()
+    end = start + seconds
+    await asyncio.gather(*(client(host, port, path, end, latencies, errors)
+            for i in range(connections)))
+    return latencies, errors, time.monotonic() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test saytime_server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--path", default="/text")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    latencies, errors, elapsed = asyncio.run(run(args.host, args.port,
+            args.path, args.connections, args.seconds))
+    latencies.sort()
+    print("{} requests in {:.1f} seconds: {:.0f} requests/second".format(
+            len(latencies), elapsed, len(latencies) / elapsed))
+    print("latency p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms".format(
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            (latencies[-1] if latencies else 0) * 1000))
+    if errors:
+        print("{} errors, e.g. {}".format(len(errors), errors[0]))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
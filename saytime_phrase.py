@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#!
+# saytime_phrase.py
+#
+# Phrase engine shared by saytime.py and saytime_espeak.py
+#
+# Every minute of the day always gives the same time phrase, so all 1440
+# phrases are built once, in terse and verbose form, and looked up by
+# minute-of-day index. The date prefix only changes at midnight, so it is
+# built once and kept until the next midnight.
+#
+# Terse:   The time is just after ten past three in the afternoon.
+# Verbose: February the 14th of 2019 is Thursday and the time is ...
+#
+import time
+from datetime import date, datetime, timedelta
+
+MINUTES_PER_DAY = 24 * 60
+
+# Message lists
+five_minute_list = ["the hour of", "five past", "ten past", "quarter past",
+            "twenty past", "twenty-five past", "half past", "twenty-five to",
+            "twenty to", "quarter to", "ten to", "five to", "the hour of"]
+
+how_near_list = ["soon to be", "almost", "exactly", "just after",
+            "a little after"]
+
+hour_list = ["twelve", "one", "two", "three", "four", "five", "six", "seven",
+            "eight", "nine", "ten", "eleven", "twelve", "one", "two", "three",
+            "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+            "twelve"]
+
+time_of_day = ["at night", "in the morning", "in the afternoon",
+            "in the evening"]
+
+def round_to_5_minute(x, base=5):
+    # Round the minutes to 5 minute intervals. E.g. 3 to 7 will rounded to 5.
+    return int(base * round(float(x)/base))
+
+def get_five_minute(minute):
+    # Create the how-near to the 5 minute message and the 5 min message.
+    pointer_5_minute_list = round_to_5_minute(minute)//5
+    offset = minute - round_to_5_minute(minute) + 2
+    return how_near_list[offset], five_minute_list[pointer_5_minute_list]
+
+def get_hour(hour, minute):
+    # Create the message for the hour
+    if minute < 33:
+        hour_pointer = hour
+    else:
+        hour_pointer = hour + 1
+    return hour_list[hour_pointer]
+
+def get_time_of_day(hour):
+    # Create message for the period of time throughout the day.
+    if hour in [0,1,2,3,4,5,22,23,24]: time_or_day_pointer = 0 # night
+    if hour >5 and hour <= 11: time_or_day_pointer = 1  # morning
+    if hour >11 and hour <= 17: time_or_day_pointer = 2  # afternoon
+    if hour >17 and hour <= 21: time_or_day_pointer = 3  # evening
+    return time_of_day[time_or_day_pointer]
+
+def build_phrase_table(lead_in):
+    """
+    Build the phrase for every minute of the day, indexed by hour * 60 + minute.
+    lead_in = "The time is " for terse, "the time is " to follow a date prefix.
+    Returns a tuple, so the table is compact and read-only.
+    """
+    # The minute part does not depend on the hour, so is made once.
+    minute_parts = [lead_in + " ".join(get_five_minute(minute)) + " "
+            for minute in range(60)]
+    table = []
+    for hour in range(24):
+        time_of_day_part = " " + get_time_of_day(hour) + "."
+        for minute in range(60):
+            table.append(minute_parts[minute] + get_hour(hour, minute) +
+                    time_of_day_part)
+    return tuple(table)
+
+terse_table = build_phrase_table("The time is ")
+verbose_table = build_phrase_table("the time is ")
+
+def get_day_suffix(day_number):
+    # 1st, 2nd, 3rd, 4th ... 21st, 22nd, 23rd, 24th ... 31st
+    if day_number in (1, 21, 31): return str(day_number) + "st"
+    if day_number in (2, 22): return str(day_number) + "nd"
+    if day_number in (3, 23): return str(day_number) + "rd"
+    return str(day_number) + "th"
+
+def build_day_month_year(day):
+    # Build the day month year related message for a datetime.date
+    # February the 14th of 2019 is Thursday and ...
+    return (day.strftime("%B") + " the " + get_day_suffix(day.day) + " of " +
+            str(day.year) + " is " + day.strftime("%A") + " and ")
+
+# [message, time.time() of the next local midnight]
+_day_month_year_cache = ["", 0.0]
+
+def get_day_month_year():
+    """
+    Date prefix for today. Built once and re-used until the next local
+    midnight, so most calls are one time.time() and a compare.
+    """
+    if time.time() >= _day_month_year_cache[1]:
+        today = date.today()
+        midnight = datetime.combine(today + timedelta(days=1),
+                datetime.min.time())
+        _day_month_year_cache[0] = build_day_month_year(today)
+        _day_month_year_cache[1] = midnight.timestamp()
+    return _day_month_year_cache[0]
+
+def get_time_phrase(hour, minute, verbose=False):
+    # O(1) lookup of the phrase for hour (0-23) and minute (0-59).
+    if verbose:
+        return get_day_month_year() + verbose_table[hour * 60 + minute]
+    return terse_table[hour * 60 + minute]
+
+def get_time_clips(hour, minute, verbose=False, day=None):
+    """
+    The phrase as a list of sentences to be spoken one after the other.
+    Verbose speaks the date prefix as its own clip, so the audio for each
+    part can be cached: one clip per day plus one per minute of the day,
+    instead of one per minute of every day.
+    day = datetime.date of the date prefix, by default today. Give it when
+    rendering ahead of time, e.g. at 23:59 for 00:00.
+    """
+    if verbose:
+        prefix = get_day_month_year() if day is None else \
+                build_day_month_year(day)
+        return [prefix.rstrip(), verbose_table[hour * 60 + minute]]
+    return [terse_table[hour * 60 + minute]]
+
+def get_date_clip(day):
+    # The date prefix clip, as spoken by get_time_clips(), for a datetime.date
+    return build_day_month_year(day).rstrip()
+
+def get_current_phrase(verbose=False):
+    # Phrase for the local time now. Reads the clock once.
+    now = time.localtime()
+    return get_time_phrase(now.tm_hour, now.tm_min, verbose)
+
+if __name__ == "__main__":
+
+    print(get_current_phrase())
+    print(get_current_phrase(True))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#!
+# saytime_scheduler.py
+#
+# Long-running speaking clock. Announces the time on every 5 minute (or
+# other) boundary, with the announcement starting on the boundary rather
+# than seconds after it, as happens when cron starts saytime.py.
+#
+# A little before each boundary the phrase is looked up and its audio
+# fetched, or rendered by espeak if it can not be fetched, so at the
+# boundary all that is left to do is play it. Sleeping
+# is timed with the monotonic clock. Each wake checks that the wall clock
+# has moved by the same amount; if not, the clock was changed or the
+# machine was suspended, and the next boundary is worked out again. A
+# boundary that was missed by more than STALE seconds is not announced.
+# An announcement still waiting in the speech queue (speech_queue.py)
+# MAX_LATE seconds after its boundary is dropped as out of date.
+#
+# $ saytime_scheduler.py                       # every 5 minutes
+# $ saytime_scheduler.py --interval 15 --verbose
+#
+import sys
+import time
+import argparse
+from datetime import date
+try:
+    from pylib.saytime_phrase import get_time_clips
+    from pylib.announce import fetch_online, render_espeak, speak_clips
+    from pylib.mpv_player import get_player, PlayerError
+except ImportError:
+    from saytime_phrase import get_time_clips
+    from announce import fetch_online, render_espeak, speak_clips
+    from mpv_player import get_player, PlayerError
+
+INTERVAL = 5
+# Seconds before the boundary to fetch the audio.
+LEAD = 15.0
+# Longest sleep between clock checks.
+SLICE = 5.0
+# Difference between wall and monotonic time counted as a clock jump.
+JUMP = 1.0
+# Seconds after a boundary it may still be announced.
+STALE = 30.0
+# Seconds after a boundary its announcement may still be spoken.
+MAX_LATE = 90.0
+
+class ClockJumped(Exception):
+    pass
+
+def next_boundary(now, interval=INTERVAL):
+    # time.time() of the next local boundary of interval minutes after now.
+    offset = time.localtime(now).tm_gmtoff
+    step = interval * 60
+    return ((now + offset) // step + 1) * step - offset
+
+def sleep_until(wall_time):
+    """
+    Sleep until time.time() reaches wall_time, timing with the monotonic
+    clock. Raises ClockJumped if the wall clock moves differently from the
+    monotonic clock, e.g. after a suspend or a clock change.
+    """
+    wall_start = time.time()
+    monotonic_start = time.monotonic()
+    target = monotonic_start + (wall_time - wall_start)
+    while True:
+        remaining = target - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, SLICE))
+        drift = ((time.time() - wall_start) -
+                (time.monotonic() - monotonic_start))
+        if abs(drift) > JUMP:
+            raise ClockJumped(drift)
+
+def prepare(hour, minute, verbose, language, day=None):
+    """
+    Get the audio for an announcement: google's voice, or espeak's if it
+    can not be fetched. Returns the clips and a (data, suffix) for each,
+    (None, None) if neither voice worked.
+    day = datetime.date of the boundary, which at 23:59 is tomorrow.
+    """
+    clips = get_time_clips(hour, minute, verbose, day)
+    audio = []
+    for clip in clips:
+        try:
+            audio.append((fetch_online(clip, language), ".mp3"))
+            continue
+        except Exception:
+            pass
+        try:
+            audio.append((render_espeak(clip), ".wav"))
+        except Exception:
+            audio.append((None, None))
+    return clips, audio
+
+def speak(clips, audio, boundary):
+    # Play prepared audio, or print a clip neither voice could say, as one
+    # entry in the speech queue. Dropped if not started by boundary +
+    # MAX_LATE, so the date is never spoken without the time.
+    return speak_clips(clips, audio, max_delay=boundary + MAX_LATE -
+            time.time())
+
+def run(interval=INTERVAL, verbose=False, language="en", lead=LEAD):
+    # Announce the time on every boundary until interrupted.
+    try:
+        # Start mpv now rather than at the first boundary.
+        get_player().ensure_running()
+    except PlayerError:
+        pass
+    last = 0.0
+    while True:
+        # Never the boundary just announced, even if the sleep woke early.
+        boundary = next_boundary(max(time.time(), last), interval)
+        try:
+            sleep_until(boundary - lead)
+            t = time.localtime(boundary)
+            clips, audio = prepare(t.tm_hour, t.tm_min, verbose, language,
+                    date(t.tm_year, t.tm_mon, t.tm_mday))
+            sleep_until(boundary)
+        except ClockJumped:
+            continue
+        if time.time() - boundary > STALE:
+            # Too late, e.g. the fetch outlasted the lead time.
+            last = boundary
+            continue
+        last = boundary
+        speak(clips, audio, boundary)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Announce the time on every boundary.")
+    parser.add_argument("--interval", type=int, default=INTERVAL,
+            help="minutes between announcements (5)")
+    parser.add_argument("--verbose", action="store_true",
+            help="include the date")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--lead", type=float, default=LEAD,
+            help="seconds before the boundary to fetch the audio (15)")
+    args = parser.parse_args(argv)
+    if not 0 < args.interval <= 60 or 60 % args.interval:
+        parser.error("--interval must divide 60")
+    try:
+        run(args.interval, args.verbose, args.language, args.lead)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#!
+# saytime_server.py
+#
+# Speaking clock service. One long-running process answers HTTP requests
+# for the saytime phrase, so no python interpreter has to start for each
+# announcement.
+#
+# GET /text                     The time is just after ten past three ...
+# GET /text?verbose=1           With the date
+# GET /text?time=15:12          For a given time, instead of now
+# GET /audio?language=en-au     mp3 data for the phrase
+# GET /metrics                  Prometheus metrics, with --metrics
+#
+# Responses for the current and next minute are built ahead of time, audio
+# included, so a request at the minute boundary is answered from memory.
+# HTTP/1.1 keep-alive is supported. See saytime_loadgen.py to measure it.
+#
+# $ saytime_server.py --port 8053
+# $ curl localhost:8053/text
+#
+import sys
+import time
+import asyncio
+import argparse
+import urllib.parse
+from datetime import date
+try:
+    from pylib.saytime_phrase import get_time_phrase, get_time_clips
+    from pylib.gspeak import get_mp3
+    from pylib import metrics
+except ImportError:
+    from saytime_phrase import get_time_phrase, get_time_clips
+    from gspeak import get_mp3
+    import metrics
+
+PORT = 8053
+# Languages whose audio is built ahead of time.
+LANGUAGES = ("en",)
+BACKLOG = 4096
+
+def http_response(status, body, content_type="text/plain; charset=utf-8",
+        keep_alive=True):
+    # Complete HTTP/1.1 response as bytes.
+    head = ("HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+            "Connection: {}\r\n\r\n").format(status, content_type, len(body),
+            "keep-alive" if keep_alive else "close")
+    return head.encode("ascii") + body
+
+NOT_FOUND = "404 Not Found", b"Not found\n"
+BAD_REQUEST = "400 Bad Request", b"Bad request\n"
+UNAVAILABLE = "503 Service Unavailable", b"Audio not available\n"
+
+class SaytimeServer:
+    """
+    asyncio speaking clock.
+    languages = languages whose audio is rendered ahead of time.
+    """
+    def __init__(self, languages=LANGUAGES):
+        self.languages = languages
+        # (day, hour, minute, verbose, language) : mp3 data, for the current
+        # and next minute. day is the datetime.date the verbose phrase says,
+        # so the 00:00 audio rendered at 23:59 has tomorrow's date.
+        self.audio = {}
+        self.requests = 0
+        self.prerender_task = None
+
+    async def render_audio(self, day, hour, minute, verbose, language):
+        # mp3 data for a phrase on day, fetched in a worker thread.
+        key = (day, hour, minute, verbose, language)
+        if key in self.audio:
+            return self.audio[key]
+        loop = asyncio.get_running_loop()
+        clips = get_time_clips(hour, minute, verbose, day)
+        parts = await asyncio.gather(*(loop.run_in_executor(None, get_mp3,
+                clip, language) for clip in clips))
+        # mp3 streams can be joined end to end.
+        return b"".join(bytes(part) for part in parts)
+
+    async def prerender(self):
+        # Keep audio for the current and next minute ready.
+        while True:
+            now = time.time()
+            wanted = set()
+            for offset in (0, 60):
+                t = time.localtime(now + offset)
+                day = date(t.tm_year, t.tm_mon, t.tm_mday)
+                for verbose in (False, True):
+                    for language in self.languages:
+                        wanted.add((day, t.tm_hour, t.tm_min, verbose,
+                                language))
+            for key in wanted:
+                if key not in self.audio:
+                    try:
+                        self.audio[key] = await self.render_audio(*key)
+                    except Exception:
+                        pass
+            for key in list(self.audio):
+                if key not in wanted:
+                    del self.audio[key]
+            # Wake a little after the next minute starts.
+            await asyncio.sleep(60.5 - now % 60)
+
+    def parse_query(self, query):
+        # (day, hour, minute, verbose, language) from the query string.
+        values = urllib.parse.parse_qs(query)
+        verbose = values.get("verbose", ["0"])[0] not in ("0", "", "false")
+        language = values.get("language", ["en"])[0]
+        if "time" in values:
+            hour, minute = (int(part) for part in
+                    values["time"][0].split(":"))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError("time out of range")
+            day = date.today()
+        else:
+            t = time.localtime()
+            day = date(t.tm_year, t.tm_mon, t.tm_mday)
+            hour, minute = t.tm_hour, t.tm_min
+        return day, hour, minute, verbose, language
+
+    async def respond(self, path, keep_alive):
+        parts = urllib.parse.urlsplit(path)
+        if parts.path == "/metrics" and metrics.enabled:
+            return http_response("200 OK", metrics.get_registry(
+                    ).to_prometheus().encode("utf-8"),
+                    "text/plain; version=0.0.4", keep_alive)
+        if parts.path not in ("/text", "/audio"):
+            return http_response(*NOT_FOUND, keep_alive=keep_alive)
+        try:
+            day, hour, minute, verbose, language = self.parse_query(
+                    parts.query)
+        except ValueError:
+            return http_response(*BAD_REQUEST, keep_alive=keep_alive)
+
+        if parts.path == "/text":
+            return http_response("200 OK", (get_time_phrase(hour, minute,
+                    verbose) + "\n").encode("utf-8"), keep_alive=keep_alive)
+
+        mp3_data = self.audio.get((day, hour, minute, verbose, language))
+        if mp3_data is None:
+            try:
+                mp3_data = await self.render_audio(day, hour, minute,
+                        verbose, language)
+            except Exception:
+                return http_response(*UNAVAILABLE, keep_alive=keep_alive)
+        return http_response("200 OK", mp3_data, "audio/mpeg", keep_alive)
+
+    async def handle(self, reader, writer):
+        # One client connection, several requests if kept alive.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = request_line.rstrip().endswith(b"HTTP/1.1")
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    if header.lower().startswith(b"connection:"):
+                        keep_alive = b"close" not in header.lower()
+                try:
+                    method, path, version = request_line.decode(
+                            "latin-1").split()
+                except ValueError:
+                    writer.write(http_response(*BAD_REQUEST, keep_alive=False))
+                    break
+                self.requests += 1
+                if method != "GET":
+                    writer.write(http_response("405 Method Not Allowed",
+                            b"GET only\n", keep_alive=keep_alive))
+                else:
+                    writer.write(await self.respond(path, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="", port=PORT, prerender=True):
+        server = await asyncio.start_server(self.handle, host, port,
+                backlog=BACKLOG)
+        if prerender:
+            self.prerender_task = asyncio.get_running_loop().create_task(
+                    self.prerender())
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Speaking clock service.")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--language", action="append",
+            help="render audio ahead of time for this language (en)")
+    parser.add_argument("--no-prerender", action="store_true",
+            help="do not fetch audio ahead of time")
+    parser.add_argument("--metrics", action="store_true",
+            help="collect metrics and serve them on /metrics")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+
+    server = SaytimeServer(tuple(args.language or LANGUAGES))
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                not args.no_prerender))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#!
+# single_flight.py
+#
+# Coalesce identical calls made at the same time. The first caller for a
+# key runs the function; callers arriving with the same key while it runs
+# wait for it and get the same result, or the same exception.
+#
+# Used by gspeak.fetch_mp3() so that many requests for the same message at
+# the top of the minute send one request to google.
+#
+# Example of use:
+# flights = SingleFlight()
+# mp3_data = flights.do(("bonjour", "fr"), download_mp3, "bonjour", "fr")
+#
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Callers that waited for this call instead of making their own.
+        self.shared = 0
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Return function(*args, **kwargs), sharing one call between all
+        callers with the same key at the same time.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        # Number of keys with a call running.
+        with self.lock:
+            return len(self.calls)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#!
+# speech_queue.py
+#
+# One queue for everything that speaks: mpv (gspeak), espeak, the PCM sink
+# (pcm_store.py, fragments.py) and GStreamer (google_tts_gstereamer.py calls
+# get_queue().say() itself).
+# Each utterance has a priority and may have a deadline. One worker thread
+# plays the most urgent utterance first, and drops any whose deadline has
+# passed before its turn - a time announcement that is already wrong is
+# not worth saying. An utterance more urgent than the one playing stops it.
+#
+# Example of use:
+# say_mp3(mp3_data)                                  # wait until played
+# say_mp3(mp3_data, URGENT)                          # interrupts lower
+# say_espeak("The time is exactly three o'clock.", max_delay=90)
+#
+import time
+import heapq
+import itertools
+import threading
+
+# Priorities. Lower numbers are more urgent.
+URGENT = 0
+NORMAL = 5
+LOW = 9
+
+# Utterance.status values
+WAITING = "waiting"
+PLAYED = "played"
+DROPPED = "dropped"
+INTERRUPTED = "interrupted"
+FAILED = "failed"
+
+class Utterance:
+    """
+    Something to be spoken.
+    play = function that speaks and returns when finished.
+    stop = function, called from another thread, that makes play return
+           early. None if it can not be interrupted.
+    priority = URGENT, NORMAL, LOW or any number in between.
+    deadline = time.monotonic() after which it is dropped, or None.
+    """
+    def __init__(self, play, stop=None, priority=NORMAL, deadline=None,
+            name=""):
+        self.play = play
+        self.stop = stop
+        self.priority = priority
+        self.deadline = deadline
+        self.name = name
+        self.status = WAITING
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        # Wait until played, dropped or interrupted. Returns the status.
+        self.done.wait(timeout)
+        return self.status
+
+class SpeechQueue:
+    def __init__(self):
+        self.heap = []
+        self.sequence = itertools.count()
+        self.changed = threading.Condition()
+        self.current = None
+        self.worker = None
+
+    def submit(self, utterance, preempt=True):
+        """
+        Queue an utterance. If preempt and it is more urgent than the one
+        playing, the one playing is stopped.
+        """
+        with self.changed:
+            heapq.heappush(self.heap, (utterance.priority,
+                    next(self.sequence), utterance))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+            self.changed.notify()
+            if (preempt and self.current is not None and
+                    utterance.priority < self.current.priority):
+                self._interrupt()
+        return utterance
+
+    def say(self, play, stop=None, priority=NORMAL, max_delay=None, name="",
+            wait=True):
+        """
+        Queue play/stop as an utterance and wait for it.
+        max_delay = seconds from now after which it is dropped, or None.
+        wait = False to return WAITING at once. Errors are then not raised.
+        Errors raised by play are raised here.
+        Returns the status.
+        """
+        deadline = None
+        if max_delay is not None:
+            deadline = time.monotonic() + max_delay
+        utterance = Utterance(play, stop, priority, deadline, name)
+        if threading.current_thread() is self.worker:
+            # Called while speaking, e.g. a fallback path. Speak it now.
+            self._play(utterance)
+        else:
+            self.submit(utterance)
+            if not wait:
+                return utterance.status
+            utterance.wait()
+        if utterance.error is not None:
+            raise utterance.error
+        return utterance.status
+
+    def _run(self):
+        while True:
+            with self.changed:
+                while not self.heap:
+                    self.changed.wait()
+                priority, sequence, utterance = heapq.heappop(self.heap)
+            if (utterance.deadline is not None and
+                    time.monotonic() > utterance.deadline):
+                utterance.status = DROPPED
+                utterance.done.set()
+                continue
+            self._play(utterance)
+
+    def _play(self, utterance):
+        with self.changed:
+            previous = self.current
+            self.current = utterance
+        try:
+            utterance.play()
+            if utterance.status == WAITING:
+                utterance.status = PLAYED
+        except Exception as e:
+            utterance.status = FAILED
+            utterance.error = e
+        finally:
+            with self.changed:
+                self.current = previous
+            utterance.done.set()
+
+    def clear(self):
+        # Drop everything waiting, and stop what is playing.
+        with self.changed:
+            waiting = [utterance for p, s, utterance in self.heap]
+            self.heap = []
+            self._interrupt()
+        for utterance in waiting:
+            utterance.status = DROPPED
+            utterance.done.set()
+
+    def _interrupt(self):
+        # Stop the utterance playing. Called with self.changed held, so it
+        # can not finish meanwhile and the stop reach the one after it.
+        current = self.current
+        if current is not None and current.stop is not None:
+            current.status = INTERRUPTED
+            current.stop()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    # The shared queue for this process, created on first use.
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = SpeechQueue()
+    return _queue
+
+def say_mp3(mp3_data, priority=NORMAL, max_delay=None, suffix=".mp3"):
+    # Speak audio data through the long-lived mpv. Raises PlayerError.
+    try:
+        from pylib.mpv_player import get_player
+    except ImportError:
+        from mpv_player import get_player
+    player = get_player()
+    return get_queue().say(lambda: player.play_bytes(mp3_data, suffix=suffix),
+            player.stop, priority, max_delay, "mpv")
+
+def say_pcm(pcm_data, priority=NORMAL, max_delay=None, wait=True):
+    # Speak raw PCM through the long-lived pacat or aplay. Raises OSError.
+    try:
+        from pylib.pcm_store import get_sink
+    except ImportError:
+        from pcm_store import get_sink
+    sink = get_sink()
+    return get_queue().say(lambda: sink.write(pcm_data), sink.stop, priority,
+            max_delay, "pcm", wait)
+
+def say_espeak(message, priority=NORMAL, max_delay=None, speaker=None):
+    # Speak text through espeak_backend, with the shared speaker by default.
+    if speaker is None:
+        try:
+            from pylib.espeak_backend import get_speaker
+        except ImportError:
+            from espeak_backend import get_speaker
+        speaker = get_speaker()
+    return get_queue().say(lambda: speaker.say(message), speaker.cancel,
+            priority, max_delay, "espeak")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#!
+# voice_pack.py
+#
+# All the audio saytime needs in one read-only file, for machines with no
+# network. The file is an index followed by one blob of clip data:
+#
+# b"SAYVOICE"             8 bytes magic
+# version                 4 bytes, little-endian
+# index length            4 bytes, little-endian
+# index                   JSON list of [kind, language, text, offset, length]
+# clip data               offsets are from the start of the file
+#
+# kind is "mp3" (google translate), "pcm" (pcm_store.py format) or "wav"
+# (espeak, with the espeak voice as the language).
+# The reader maps the file with mmap and returns memoryview slices of it,
+# so a lookup copies nothing.
+#
+# Set SAYTIME_VOICE_PACK to the pack's path, or put it at PACK_PATH.
+#
+# $ voice_pack.py build saytime.voicepack --language en --days 30
+# $ voice_pack.py list saytime.voicepack
+#
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+try:
+    from pylib.audio_cache import CACHE_DIR
+except ImportError:
+    from audio_cache import CACHE_DIR
+
+MAGIC = b"SAYVOICE"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+PACK_PATH = os.environ.get("SAYTIME_VOICE_PACK",
+        os.path.join(CACHE_DIR, "saytime.voicepack"))
+
+class VoicePackError(Exception):
+    pass
+
+class VoicePack:
+    """
+    Read-only, memory-mapped voice pack.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, index_length = HEADER.unpack_from(self.mmap, 0)
+            if magic != MAGIC or version != VERSION:
+                raise VoicePackError("not a version {} voice pack: {}".format(
+                        VERSION, path))
+            index = json.loads(self.mmap[HEADER.size:
+                    HEADER.size + index_length].decode("utf-8"))
+        except (struct.error, ValueError) as e:
+            self.mmap.close()
+            raise VoicePackError("bad voice pack {}: {}".format(path, e))
+        except VoicePackError:
+            self.mmap.close()
+            raise
+        self.view = memoryview(self.mmap)
+        self.entries = {(kind, language, text): (offset, length)
+                for kind, language, text, offset, length in index}
+
+    def get(self, text, language="en", kind="mp3"):
+        # memoryview of the clip's data, or None if it is not in the pack.
+        entry = self.entries.get((kind, language, text))
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.view[offset:offset + length]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+
+def build(path, clips):
+    """
+    Write a voice pack.
+    clips = iterable of (kind, language, text, data)
+    The file is written to a temporary name and renamed into place.
+    """
+    index = []
+    blobs = []
+    offset = 0
+    for kind, language, text, data in clips:
+        index.append([kind, language, text, offset, len(data)])
+        blobs.append(data)
+        offset += len(data)
+    # Offsets are relative to the data until the header size is known.
+    index_length = 0
+    while True:
+        start = HEADER.size + index_length
+        encoded = json.dumps([[kind, language, text, start + offset, length]
+                for kind, language, text, offset, length in index],
+                ensure_ascii=False).encode("utf-8")
+        if len(encoded) == index_length:
+            break
+        index_length = len(encoded)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".voicepack-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, index_length))
+            f.write(encoded)
+            for data in blobs:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(index)
+
+_pack = None
+_pack_checked = False
+
+def get_pack():
+    # The VoicePack at PACK_PATH, or None if there is no pack.
+    global _pack, _pack_checked
+    if not _pack_checked:
+        _pack_checked = True
+        try:
+            _pack = VoicePack(PACK_PATH)
+        except (OSError, ValueError, VoicePackError):
+            _pack = None
+    return _pack
+
+def lookup(text, language="en", kind="mp3"):
+    # Clip data from the installed pack, or None.
+    pack = get_pack()
+    if pack is None:
+        return None
+    return pack.get(text, language, kind)
+
+def collect(languages, days, espeak_voices=()):
+    """
+    Clips for every saytime phrase and fragment found in the mp3 cache and
+    the PCM store, plus espeak renders of the phrases for espeak_voices.
+    """
+    try:
+        from pylib.audio_cache import get_cache
+        from pylib.pcm_store import get_store
+        from pylib.prewarm_cache import list_clips
+        from pylib.fragments import list_fragments
+        from pylib.announce import render_espeak
+    except ImportError:
+        from audio_cache import get_cache
+        from pcm_store import get_store
+        from prewarm_cache import list_clips
+        from fragments import list_fragments
+        from announce import render_espeak
+
+    clips = list_clips(days)
+    texts = list(dict.fromkeys(clips + list_fragments()))
+    for language in languages:
+        for text in texts:
+            mp3_data = get_cache().get(text, language)
+            if mp3_data is not None:
+                yield "mp3", language, text, mp3_data
+            pcm_data = get_store().get(text, language)
+            if pcm_data is not None:
+                yield "pcm", language, text, pcm_data
+    for voice in espeak_voices:
+        for text in clips:
+            yield "wav", voice, text, render_espeak(text, voice)
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or list a voice pack.")
+    parser.add_argument("action", choices=("build", "list"))
+    parser.add_argument("path", nargs="?", default=PACK_PATH)
+    parser.add_argument("--language", action="append",
+            help="google translate language to include (en)")
+    parser.add_argument("--days", type=int, default=30,
+            help="date prefixes for the next DAYS days (30)")
+    parser.add_argument("--espeak-voice", action="append", default=[],
+            help="also render the phrases with this espeak voice")
+    args = parser.parse_args()
+
+    if args.action == "build":
+        count = build(args.path, collect(args.language or ["en"], args.days,
+                args.espeak_voice))
+        print("{} clips written to {}".format(count, args.path))
+    else:
+        pack = VoicePack(args.path)
+        for (kind, language, text), (offset, length) in sorted(
+                pack.entries.items()):
+            print("{}\t{}\t{}\t{}".format(kind, language, length, text))
+        print("{} clips".format(len(pack)), file=sys.stderr)